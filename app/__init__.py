@@ -1,4 +1,6 @@
+import os
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
@@ -26,6 +28,27 @@ def create_app():
     mail.init_app(app)
     migrate.init_app(app, db)
 
+    # Share compiled templates between workers
+    cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR') or \
+        os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    # Serve fingerprinted, precompressed static files once `flask assets build` has run
+    from . import assets
+    assets.init_app(app)
+
+    # Local click spool so redirects survive database outages
+    from . import click_spool
+    click_spool.init_app(app)
+
+    # Per-IP and per-link limits on recorded clicks, shared between workers
+    from . import rate_limit
+    rate_limit.init_app(app)
+
+    from . import commands
+    commands.init_app(app)
+
     with app.app_context():
         # Import models and routes
         from .models import user, link_tracking
@@ -64,4 +87,15 @@ def create_app():
             db.session.commit()
             print('Admin setup complete')
 
+        if app.config.get('WARM_START'):
+            warm_up(app)
+
         return app
+
+def warm_up(app):
+    """Compile every template and load the enrichment tables so the first
+    request a worker serves doesn't pay for them."""
+    from . import enrichment
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    enrichment.preload()
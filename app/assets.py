@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import time
+import click
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip variants are still built
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# Files that reference siblings by relative path (web manifests etc.) are left alone
+FINGERPRINT_EXTENSIONS = {'.css', '.js', '.svg', '.png', '.jpg', '.jpeg', '.webp', '.gif', '.ico', '.woff', '.woff2'}
+COMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.ico'}
+# Don't bother precompressing tiny files, the headers cost more than they save
+MIN_COMPRESS_SIZE = 512
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def build(static_folder):
+    """Copy fingerprinted static files into dist/ with .gz/.br variants.
+
+    Files from earlier builds are kept: running workers still link to them
+    from the manifest they loaded, and browsers cache their URLs for a
+    year (see `prune`). The manifest is replaced atomically.
+
+    Returns the manifest, mapping original paths to their hashed copies.
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+        for name in sorted(files):
+            base, ext = os.path.splitext(name)
+            if ext.lower() not in FINGERPRINT_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            rel_dir = os.path.relpath(root, static_folder)
+            hashed = os.path.normpath(os.path.join(DIST_DIR, rel_dir, f'{base}.{digest}{ext}'))
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write(target, data)
+
+            if ext.lower() in COMPRESS_EXTENSIONS and len(data) >= MIN_COMPRESS_SIZE:
+                _write(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(target + '.br', brotli.compress(data, quality=11))
+
+            original = os.path.normpath(os.path.join(rel_dir, name))
+            manifest[original.replace(os.sep, '/')] = hashed.replace(os.sep, '/')
+
+    _write(os.path.join(dist, MANIFEST_NAME),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def _write(path, data):
+    # Write to a temporary name and rename, so a file being served is never
+    # seen half-written
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def prune(static_folder, older_than):
+    """Delete hashed files the current manifest doesn't use and that were
+    last built more than older_than seconds ago. Returns how many."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    current = set(load_manifest(static_folder).values())
+    cutoff = time.time() - older_than
+    removed = 0
+    for root, dirs, files in os.walk(dist):
+        for name in files:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            original = rel[:-3] if rel.endswith(('.gz', '.br')) else rel
+            if rel == f'{DIST_DIR}/{MANIFEST_NAME}' or original in current:
+                continue
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def serve_static(filename):
+    """Static view that serves hashed files with far-future caching and
+    picks a precompressed variant when the client accepts one."""
+    if not filename.startswith(DIST_DIR + '/') or filename == f'{DIST_DIR}/{MANIFEST_NAME}':
+        # Only hashed files can be cached forever; the manifest keeps its name
+        return current_app.send_static_file(filename)
+
+    static_folder = current_app.static_folder
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accepted = request.accept_encodings
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[encoding] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            response = send_from_directory(static_folder, filename + suffix,
+                                           mimetype=mimetype, max_age=ONE_YEAR)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(static_folder, filename, max_age=ONE_YEAR)
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@click.group('assets')
+def assets_cli():
+    """Static asset build commands."""
+
+
+@assets_cli.command('build')
+def build_command():
+    """Fingerprint and precompress app/static into app/static/dist."""
+    manifest = build(current_app.static_folder)
+    current_app.extensions['asset_manifest'] = manifest
+    print(f'Fingerprinted {len(manifest)} file(s)' + ('' if brotli else ' (brotli not installed, gzip only)'))
+
+
+@assets_cli.command('prune')
+@click.option('--days', default=30, show_default=True,
+              help='Keep files from earlier builds for this long (cached pages may still link to them).')
+def prune_command(days):
+    """Delete hashed files from earlier builds."""
+    removed = prune(current_app.static_folder, days * 24 * 60 * 60)
+    print(f'Removed {removed} file(s)')
+
+
+def init_app(app):
+    app.extensions['asset_manifest'] = load_manifest(app.static_folder)
+    app.view_functions['static'] = serve_static
+    app.cli.add_command(assets_cli)
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        # Rewrites url_for('static', filename=...) to the hashed name when built
+        if endpoint == 'static' and 'filename' in values:
+            hashed = app.extensions['asset_manifest'].get(values['filename'])
+            if hashed:
+                values['filename'] = hashed
@@ -0,0 +1,295 @@
+"""Asyncio entry point for the public referral redirect.
+
+An optional ASGI service that answers only `/r/<unique_link>`, for
+deployments where bursts of campaign traffic would otherwise need many
+sync workers each blocked on the database. It shares the models and
+rules of `referrals.handle_referral`: the destination comes from the
+same compiled route table, the same shared rate limiter decides whether
+the click is recorded, the click row comes from `LinkClick.enriched_row`,
+facet counts are deferred and flushed through `ClickFacet`, and clicks
+that can't be written go to the same click spool. Database access goes
+through an async driver (aiosqlite or asyncpg) with a connection pool.
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 'app.async_redirect:create_service()'
+
+(or `uvicorn --factory app.async_redirect:create_service` for a single
+process).
+
+Put it behind the proxy for `/r/` only; everything else stays on the
+Flask app. The rate limiter keys on the connecting address, which
+uvicorn takes from X-Forwarded-For only when the proxy is listed in
+FORWARDED_ALLOW_IPS (default 127.0.0.1).
+"""
+import asyncio
+import re
+import time
+from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.utils import redirect
+from . import create_app, enrichment, rate_limit, route_table
+from .models.link_tracking import GlobalRedirect, LinkClick, ClickFacet
+from .models.user import User
+
+REFERRAL_PATH = re.compile(r'^/r/([^/]+)$')
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    """The app's database URL with its driver swapped for an async one."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {backend} databases')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncRouteTable:
+    """route_table.get_table for the event loop: same compiled table, same
+    stamp file and TTL. Only the first lookup waits for a build; after that
+    a background task builds the new table while the old one is served."""
+
+    def __init__(self, engine, stamp_path, ttl):
+        self.engine = engine
+        self.stamp_path = stamp_path
+        self.ttl = ttl
+        self._table = None
+        self._built_at = 0.0
+        self._stamp = None
+        self._lock = asyncio.Lock()
+        self._rebuild_task = None
+
+    def _fresh(self, stamp):
+        return self._table is not None and stamp == self._stamp and \
+            time.monotonic() - self._built_at < self.ttl
+
+    async def _compile(self):
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(route_table.routes_query(datetime.utcnow()))).all()
+            default_url = await conn.scalar(GlobalRedirect.active_url_query())
+            links = await conn.scalars(route_table.links_query())
+        return route_table.build_table(rows, GlobalRedirect.normalize_url(default_url), links)
+
+    async def _rebuild(self, stamp):
+        try:
+            try:
+                table = await self._compile()
+            except SQLAlchemyError:
+                # Database unavailable: keep serving the last good table
+                # and try again after the TTL
+                table = self._table
+            self._table, self._built_at, self._stamp = table, time.monotonic(), stamp
+        finally:
+            self._rebuild_task = None
+
+    async def get_table(self):
+        stamp = route_table.read_stamp(self.stamp_path)
+        if self._fresh(stamp):
+            return self._table
+
+        if self._table is None:
+            async with self._lock:
+                if self._table is None:
+                    table = await self._compile()
+                    self._table, self._built_at, self._stamp = table, time.monotonic(), stamp
+            return self._table
+
+        if self._rebuild_task is None:
+            self._rebuild_task = asyncio.create_task(self._rebuild(stamp))
+        return self._table
+
+    async def resolve(self, slug):
+        try:
+            return (await self.get_table()).resolve(slug)
+        except SQLAlchemyError:
+            # Database was unavailable before the first table could be built
+            return '/'
+
+    async def has_link(self, slug):
+        try:
+            return (await self.get_table()).has_link(slug)
+        except SQLAlchemyError:
+            return False
+
+
+class RedirectService:
+    """ASGI application serving `/r/<unique_link>`."""
+
+    def __init__(self, flask_app):
+        config = flask_app.config
+        self.spool_mode = config['CLICK_SPOOL_MODE']
+        self.spool = flask_app.extensions['click_spool']
+        self.breaker = flask_app.extensions['click_breaker']
+        self.limiter = rate_limit.get_limiter(flask_app)
+        self.engine = create_async_engine(
+            async_database_url(config['SQLALCHEMY_DATABASE_URI']),
+            pool_size=config['ASYNC_DB_POOL_SIZE'],
+            max_overflow=config['ASYNC_DB_MAX_OVERFLOW'],
+        )
+        self.dialect = self.engine.dialect.name
+        # SQLite allows one writer at a time: queue this process's writers on
+        # the event loop rather than in SQLite's sleeping busy handler
+        self._write_lock = asyncio.Lock() if self.dialect == 'sqlite' else None
+        self.routes = AsyncRouteTable(
+            self.engine,
+            route_table.stamp_path(flask_app.instance_path),
+            config.get('ROUTE_TABLE_TTL', 30),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self._flush_facets(force=True)
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, send):
+        match = REFERRAL_PATH.match(scope['path'])
+        if not match:
+            await self._respond(send, 404, b'Not Found')
+            return
+        if scope['method'] not in ('GET', 'HEAD'):
+            await self._respond(send, 405, b'Method Not Allowed', [(b'allow', b'GET, HEAD')])
+            return
+
+        headers = {}
+        for name, value in scope['headers']:
+            headers.setdefault(name.decode('latin-1'), value.decode('latin-1'))
+        client = scope.get('client')
+        redirect_url = await self.handle_referral(
+            match.group(1),
+            headers.get('x-forwarded-for'),
+            client[0] if client else None,
+            headers.get('user-agent', ''),
+        )
+
+        response = redirect(redirect_url)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                        for k, v in response.headers.to_wsgi_list()],
+        })
+        body = b'' if scope['method'] == 'HEAD' else response.get_data()
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _respond(self, send, status, body, headers=()):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                        (b'content-length', str(len(body)).encode())] + list(headers),
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def handle_referral(self, unique_link, forwarded_for, remote_addr, user_agent):
+        """Record the click and return the destination for unique_link"""
+        # Get the destination for this link first
+        redirect_url = await self.routes.resolve(unique_link)
+
+        visitor_ip = enrichment.client_ip(forwarded_for, remote_addr)
+        timestamp = datetime.utcnow()
+        spool_record = {
+            'unique_link': unique_link,
+            'visitor_ip': visitor_ip,
+            'user_agent': user_agent,
+            'timestamp': timestamp.isoformat()
+        }
+
+        # Rate limit on the connecting address, not the client-supplied
+        # X-Forwarded-For, and only keep buckets for links that exist
+        link = unique_link if await self.routes.has_link(unique_link) else None
+        if not await self._allow(remote_addr, link):
+            # Over the rate limit: still redirect, but don't record the click
+            return redirect_url
+
+        if self.spool_mode == 'always' or self.breaker.is_open:
+            # The loader resolves the user and enriches the click later; with
+            # the breaker open the database just failed, so don't wait on it
+            await self._spool(spool_record)
+            return redirect_url
+
+        try:
+            # If we have a valid user, record the click
+            user_id = await self._find_user(unique_link)
+            if user_id is not None:
+                row = await self._enrich(user_id, visitor_ip, user_agent, timestamp)
+                await self._write(self._record_click(row))
+        except SQLAlchemyError:
+            # Database is down or locked: keep the click on disk for the loader
+            self.breaker.trip()
+            await self._spool(spool_record)
+
+        if not self.breaker.is_open:
+            await self._flush_facets()
+
+        # Always redirect, even if the click couldn't be recorded
+        return redirect_url
+
+    async def _write(self, coroutine):
+        if self._write_lock:
+            async with self._write_lock:
+                return await coroutine
+        return await coroutine
+
+    async def _allow(self, ip, link):
+        # The limiter waits on a lock shared with every worker, so keep it
+        # off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self.limiter.allow, ip, link)
+
+    async def _find_user(self, unique_link):
+        async with self.engine.connect() as conn:
+            return await conn.scalar(select(User.id).filter_by(unique_link=unique_link).limit(1))
+
+    async def _enrich(self, user_id, visitor_ip, user_agent, timestamp):
+        # User agent parsing and the GeoIP lookup are CPU-bound, so keep them
+        # off the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None, LinkClick.enriched_row, user_id, visitor_ip, user_agent, timestamp)
+
+    async def _record_click(self, row):
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(LinkClick), [row])
+        # Facet counts are written in batches, outside the click's transaction
+        ClickFacet.defer([row])
+
+    async def _flush_facets(self, force=False):
+        """ClickFacet.flush on the async engine."""
+        rows = ClickFacet.take_due(force)
+        if not rows:
+            return
+
+        async def upsert():
+            async with self.engine.begin() as conn:
+                await conn.execute(ClickFacet.upsert_statement(self.dialect), rows)
+        try:
+            await self._write(upsert())
+        except SQLAlchemyError:
+            ClickFacet.restore(rows)
+
+    async def _spool(self, record):
+        # Appending waits on a (shared) fsync, so keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.spool.append, record)
+
+
+def create_service():
+    """ASGI app factory."""
+    flask_app = create_app()
+    return RedirectService(flask_app)
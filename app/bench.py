@@ -0,0 +1,228 @@
+"""Synthetic click data and timings for the app's analytics queries.
+
+`seed` generates a deterministic click history: Zipf-distributed clicks
+across reps, diurnal timestamps, a weighted mix of real user agents and a
+skewed country/city mix. It bulk-loads it in executemany batches.
+`run` times every analytics query the admin pages issue and returns a
+JSON-serialisable report, so runs can be compared across commits.
+"""
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+from . import db
+from .models.link_tracking import LinkClick, ClickFacet, ip_columns
+from .models.user import User
+
+BENCH_EMAIL_DOMAIN = 'bench.invalid'
+
+# (user agent, device type, weight)
+USER_AGENTS = [
+    ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+     'Chrome/124.0.0.0 Safari/537.36', 'desktop', 30),
+    ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+     'Version/17.4 Mobile/15E148 Safari/604.1', 'mobile', 22),
+    ('Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) '
+     'Chrome/124.0.0.0 Mobile Safari/537.36', 'mobile', 18),
+    ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+     'Version/17.4 Safari/605.1.15', 'desktop', 10),
+    ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+     'Chrome/124.0.0.0 Safari/537.36 Edg/124.0.0.0', 'desktop', 7),
+    ('Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+     'Version/17.4 Mobile/15E148 Safari/604.1', 'tablet', 4),
+    ('Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0', 'desktop', 3),
+    ('Mozilla/5.0 (Linux; Android 13; SM-X700) AppleWebKit/537.36 (KHTML, like Gecko) '
+     'Chrome/124.0.0.0 Safari/537.36', 'tablet', 2),
+    ('Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)', 'desktop', 2),
+    ('facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)', 'desktop', 2),
+]
+
+# (country, region, city, weight)
+LOCATIONS = [
+    ('US', 'Texas', 'Houston', 14), ('US', 'California', 'Los Angeles', 12),
+    ('US', 'Florida', 'Miami', 10), ('US', 'Illinois', 'Chicago', 8),
+    ('US', 'New York', 'New York', 8), ('US', 'Georgia', 'Atlanta', 5),
+    ('MX', 'Nuevo León', 'Monterrey', 7), ('MX', 'Ciudad de México', 'Mexico City', 6),
+    ('CA', 'Ontario', 'Toronto', 5), ('CO', 'Bogotá D.C.', 'Bogotá', 4),
+    ('GB', 'England', 'London', 3), ('DE', 'Hesse', 'Frankfurt', 2),
+    ('BR', 'São Paulo', 'São Paulo', 2), ('IN', 'Maharashtra', 'Mumbai', 2),
+    (None, None, None, 12),
+]
+
+# Relative click volume per hour of day (UTC), peaking mid-afternoon US time
+HOURLY_WEIGHTS = [2, 1.5, 1, 1, 1, 1.5, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 9, 8, 7, 6, 5, 4, 3, 2.5]
+
+
+def _weights(values):
+    weights = np.asarray(values, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def ensure_reps(count):
+    """Return the ids of `count` bench reps, creating any that are missing."""
+    existing = dict(db.session.query(User.email, User.id)
+                    .filter(User.email.like(f'%@{BENCH_EMAIL_DOMAIN}')))
+    missing = []
+    for i in range(count):
+        email = f'bench-rep-{i}@{BENCH_EMAIL_DOMAIN}'
+        if email not in existing:
+            missing.append({
+                'name': f'Bench Rep {i}',
+                'email': email,
+                'password_hash': '!',  # Not a valid hash: bench reps can't log in
+                'unique_link': f'bench-{i}',
+                'created_at': datetime.utcnow(),
+                'is_admin': False,
+            })
+    if missing:
+        db.session.execute(insert(User), missing)
+        db.session.commit()
+        existing = dict(db.session.query(User.email, User.id)
+                        .filter(User.email.like(f'%@{BENCH_EMAIL_DOMAIN}')))
+    return [existing[f'bench-rep-{i}@{BENCH_EMAIL_DOMAIN}'] for i in range(count)]
+
+
+def generate(rng, size, rep_ids, days, end, zipf_s=1.1):
+    """Generate one batch of click rows as dicts of link_click columns."""
+    # Zipf across reps: rep k gets clicks proportional to 1 / k^s
+    rep_weights = _weights(1.0 / np.arange(1, len(rep_ids) + 1) ** zipf_s)
+    reps = rng.choice(len(rep_ids), size=size, p=rep_weights)
+
+    day = rng.integers(0, days, size=size)
+    hour = rng.choice(24, size=size, p=_weights(HOURLY_WEIGHTS))
+    second = rng.integers(0, 3600, size=size)
+    offsets = day * 86400 + (23 - hour) * 3600 + second
+
+    ua = rng.choice(len(USER_AGENTS), size=size, p=_weights([w for *_, w in USER_AGENTS]))
+    loc = rng.choice(len(LOCATIONS), size=size, p=_weights([w for *_, w in LOCATIONS]))
+    # Repeat visitors: draw addresses from a pool a third the size of the batch
+    pool = rng.integers(0x0B000000, 0xDF000000, size=max(1, size // 3))
+    ips = pool[rng.integers(0, len(pool), size=size)]
+
+    rows = []
+    for i in range(size):
+        user_agent, device_type, _ = USER_AGENTS[ua[i]]
+        country, region, city, _ = LOCATIONS[loc[i]]
+        ip = int(ips[i])
+        visitor_ip = f'{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}'
+        rows.append({
+            'user_id': rep_ids[reps[i]],
+            **ip_columns(visitor_ip),
+            'user_agent': user_agent,
+            'timestamp': end - timedelta(seconds=int(offsets[i])),
+            'country': country,
+            'region': region,
+            'city': city,
+            'device_type': device_type,
+        })
+    return rows
+
+
+def seed(clicks, reps=50, days=90, seed=42, batch_size=10000, progress=print):
+    """Insert `clicks` synthetic clicks for `reps` bench reps. Deterministic for a given seed."""
+    rng = np.random.default_rng(seed)
+    rep_ids = ensure_reps(reps)
+    # Fixed end date so the same seed gives the same rows on every run
+    end = datetime(2025, 1, 1)
+    inserted = 0
+    started = time.perf_counter()
+    while inserted < clicks:
+        size = min(batch_size, clicks - inserted)
+        rows = generate(rng, size, rep_ids, days, end)
+        db.session.execute(insert(LinkClick), rows)
+        ClickFacet.record(rows)
+        db.session.commit()
+        inserted += size
+        rate = inserted / (time.perf_counter() - started)
+        progress(f'Inserted {inserted}/{clicks} clicks ({rate:,.0f}/s)')
+    return inserted
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        # Don't let the identity map turn later repeats into cache hits
+        db.session.expunge_all()
+    return {'min_ms': round(min(timings), 2), 'median_ms': round(statistics.median(timings), 2)}
+
+
+def _click_history(args):
+    from sqlalchemy import desc
+    from .routes.referrals import filter_clicks
+
+    def run():
+        query = LinkClick.query.join(User).order_by(desc(LinkClick.timestamp))
+        query, filters, _ = filter_clicks(query, MultiDict(args))
+        if filters['q'] or filters['ip']:
+            query.limit(51).all()
+        else:
+            query.paginate(page=1, per_page=50, error_out=False).items
+    return run
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(repeat=3):
+    """Time every analytics query and return the report as a dict."""
+    from . import click_analytics
+
+    total = db.session.query(db.func.count(LinkClick.id)).scalar()
+    busiest = db.session.query(LinkClick.user_id).group_by(LinkClick.user_id)\
+        .order_by(db.func.count(LinkClick.id).desc()).limit(1).scalar()
+    some_country = db.session.query(LinkClick.country).filter(LinkClick.country.isnot(None)).limit(1).scalar()
+    user_ids = [u for (u,) in db.session.query(User.id)]
+    # The seeded history ends on a fixed date while the days filter counts
+    # back from now: widen it so it covers the last week of the data
+    latest = db.session.query(db.func.max(LinkClick.timestamp)).scalar() or datetime.utcnow()
+    last_week = (datetime.utcnow() - latest).days + 7
+
+    def admin_referrals():
+        for user_id in user_ids:
+            LinkClick.get_stats_for_user(user_id)
+
+    def analytics_cold():
+        click_analytics.ClickColumns().refresh()
+
+    columns = click_analytics.ClickColumns()
+    columns.refresh()
+
+    queries = {
+        'get_stats_for_user(busiest rep)': lambda: LinkClick.get_stats_for_user(busiest),
+        'admin_referrals (stats for every user)': admin_referrals,
+        'click_history': _click_history({}),
+        'click_history?country': _click_history({'country': some_country}),
+        'click_history?days=7': _click_history({'days': str(last_week)}),
+        'click_history?user_id': _click_history({'user_id': str(busiest)}),
+        'click_history?q=iphone': _click_history({'q': 'iphone'}),
+        'click_history?ip=CIDR /8': _click_history({'ip': '100.0.0.0/8'}),
+        'click_history filter facets': lambda: (setattr(ClickFacet, '_cache', None), ClickFacet.get_all()),
+        'click_analytics snapshot load': analytics_cold,
+        'click_analytics device x country': lambda: columns.query(group_by=['device_type', 'country']),
+        'click_analytics rep x device, 30 days': lambda: columns.query(
+            group_by=['user_id', 'device_type'], start=latest - timedelta(days=30)),
+    }
+
+    results = {name: _time(fn, repeat) for name, fn in queries.items()}
+    return {
+        'commit': _git_commit(),
+        'run_at': datetime.utcnow().isoformat(),
+        'database': db.session.get_bind().dialect.name,
+        'python': platform.python_version(),
+        'clicks': total,
+        'users': len(user_ids),
+        'repeat': repeat,
+        'queries': results,
+    }
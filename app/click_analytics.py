@@ -0,0 +1,250 @@
+"""Columnar in-memory snapshot of link clicks for ad-hoc admin slicing.
+
+Each worker keeps the clicks as NumPy columns and answers filter +
+group-by queries with vectorised operations instead of a new SQL
+GROUP BY per variation. The snapshot is refreshed incrementally by id.
+
+Ids are handed out when a click is inserted but become visible when its
+transaction commits, so a lower id (say from a spool loader batch) can
+show up after higher ones were loaded. Each refresh therefore re-scans
+every id above a watermark that trails the highest loaded id by
+SETTLE_SECONDS, skipping the ids it already has. Only the last minute or
+so of clicks is read again, and a transaction that takes longer than
+SETTLE_SECONDS to commit is missed until the next `invalidate()`.
+
+Memory per click: timestamp (int64, 8 bytes) + user id (int64, 8) +
+country (int16 code, 2) + region (int32 code, 4) + city (int32 code, 4) +
+device type (int8 code, 1) = 27 bytes, i.e. about 27 MB per million
+clicks, up to twice that while the arrays have spare capacity after
+growing. The value dictionaries add one Python string per distinct
+country/region/city/device, and the ids loaded in the last
+SETTLE_SECONDS take 8 bytes each.
+"""
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+from flask import current_app
+from . import db
+from .models.link_tracking import LinkClick
+
+# Dictionary-encoded columns and the dtype of their codes; code 0 is NULL
+ENCODED_COLUMNS = {
+    'country': np.int16,
+    'region': np.int32,
+    'city': np.int32,
+    'device_type': np.int8,
+}
+GROUP_COLUMNS = ('user_id',) + tuple(ENCODED_COLUMNS)
+LOAD_CHUNK = 50000
+INITIAL_CAPACITY = 1024
+# How long an id may stay invisible (its transaction open) and still be loaded
+SETTLE_SECONDS = 60.0
+
+
+class ClickColumns:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop the snapshot, e.g. after clicks were deleted."""
+        with self._lock:
+            # Every id up to the watermark is loaded; above it, the ids in
+            # recent (sorted) are. marks holds (time, highest id) per refresh.
+            self.watermark = 0
+            self.recent = np.empty(0, dtype=np.int64)
+            self.marks = deque()
+            self.size = 0
+            self.refreshed_at = None
+            self.timestamp = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+            self.user_id = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+            self.codes = {c: np.empty(INITIAL_CAPACITY, dtype=t) for c, t in ENCODED_COLUMNS.items()}
+            self.values = {c: [None] for c in ENCODED_COLUMNS}
+            self.lookup = {c: {None: 0} for c in ENCODED_COLUMNS}
+
+    @property
+    def nbytes(self):
+        return (self.timestamp.nbytes + self.user_id.nbytes +
+                sum(a.nbytes for a in self.codes.values()))
+
+    def _grow(self, needed):
+        capacity = len(self.timestamp)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self.timestamp = np.resize(self.timestamp, capacity)
+        self.user_id = np.resize(self.user_id, capacity)
+        self.codes = {c: np.resize(a, capacity) for c, a in self.codes.items()}
+
+    def _encode(self, column, raw):
+        lookup, values = self.lookup[column], self.values[column]
+        codes = np.empty(len(raw), dtype=ENCODED_COLUMNS[column])
+        for i, value in enumerate(raw):
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(values)
+                values.append(value)
+            codes[i] = code
+        return codes
+
+    def _append(self, rows):
+        n = len(rows)
+        start, end = self.size, self.size + n
+        self._grow(end)
+        _, timestamps, user_ids, countries, regions, cities, devices = zip(*rows)
+        self.timestamp[start:end] = to_epoch(timestamps)
+        self.user_id[start:end] = user_ids
+        for column, raw in (('country', countries), ('region', regions),
+                            ('city', cities), ('device_type', devices)):
+            self.codes[column][start:end] = self._encode(column, raw)
+        self.size = end
+
+    def refresh(self):
+        """Load clicks added since the last refresh. Returns how many were added."""
+        with self._lock:
+            added = 0
+            last_id = self.watermark
+            while True:
+                rows = db.session.query(
+                    LinkClick.id, LinkClick.timestamp, LinkClick.user_id,
+                    LinkClick.country, LinkClick.region, LinkClick.city, LinkClick.device_type
+                ).filter(LinkClick.id > last_id)\
+                 .order_by(LinkClick.id)\
+                 .limit(LOAD_CHUNK)\
+                 .all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                ids = np.array([row[0] for row in rows], dtype=np.int64)
+                loaded = np.isin(ids, self.recent, assume_unique=True)
+                new = [row for row, seen in zip(rows, loaded) if not seen]
+                if new:
+                    self._append(new)
+                    self.recent = np.union1d(self.recent, ids[~loaded])
+                    added += len(new)
+
+            # Move the watermark up to what was loaded SETTLE_SECONDS ago
+            now = time.monotonic()
+            self.marks.append((now, last_id))
+            while self.marks and now - self.marks[0][0] >= SETTLE_SECONDS:
+                _, settled = self.marks.popleft()
+                if settled > self.watermark:
+                    self.watermark = settled
+                    self.recent = self.recent[self.recent > settled]
+            self.refreshed_at = now
+            return added
+
+    def _mask(self, filters, start, end):
+        n = self.size
+        mask = np.ones(n, dtype=bool)
+        if start is not None:
+            mask &= self.timestamp[:n] >= to_epoch([start])[0]
+        if end is not None:
+            mask &= self.timestamp[:n] < to_epoch([end])[0]
+        for column, wanted in (filters or {}).items():
+            if wanted is None:
+                continue
+            if not isinstance(wanted, (list, tuple, set)):
+                wanted = [wanted]
+            if column == 'user_id':
+                mask &= np.isin(self.user_id[:n], [int(v) for v in wanted])
+            elif column in ENCODED_COLUMNS:
+                lookup = self.lookup[column]
+                codes = [lookup[v] for v in wanted if v in lookup]
+                mask &= np.isin(self.codes[column][:n], codes)
+            else:
+                raise ValueError(f'Unknown filter column: {column}')
+        return mask
+
+    def query(self, group_by=(), filters=None, start=None, end=None):
+        """Count clicks matching filters, grouped by the given columns.
+
+        filters maps a column to a value or list of values; start/end are
+        datetimes bounding the click timestamp. Returns a list of dicts
+        with the group columns and a count, largest groups first.
+        """
+        with self._lock:
+            for column in group_by:
+                if column not in GROUP_COLUMNS:
+                    raise ValueError(f'Unknown group column: {column}')
+            mask = self._mask(filters, start, end)
+            if not group_by:
+                return [{'count': int(mask.sum())}]
+
+            n = self.size
+            codes, dims, decode = [], [], []
+            for column in group_by:
+                if column == 'user_id':
+                    # Renumber user ids densely so they pack like the other codes
+                    ids, inverse = np.unique(self.user_id[:n][mask], return_inverse=True)
+                    codes.append(inverse)
+                    dims.append(max(len(ids), 1))
+                    decode.append(lambda code, ids=ids: int(ids[code]))
+                else:
+                    codes.append(self.codes[column][:n][mask])
+                    dims.append(len(self.values[column]))
+                    decode.append(lambda code, values=self.values[column]: values[code])
+
+            # Pack each row's codes into one int64 so a 1-D unique does the
+            # grouping (np.unique with axis=1 is over 100x slower)
+            keys, counts = np.unique(np.ravel_multi_index(codes, dims), return_counts=True)
+            group_codes = np.unravel_index(keys, dims)
+            order = np.argsort(-counts, kind='stable')
+
+            results = []
+            for i in order:
+                row = {column: fn(column_codes[i])
+                       for column, fn, column_codes in zip(group_by, decode, group_codes)}
+                row['count'] = int(counts[i])
+                results.append(row)
+            return results
+
+
+def to_epoch(timestamps):
+    """Datetimes to int64 microseconds since the epoch (NULL becomes the minimum)."""
+    return np.array(timestamps, dtype='datetime64[us]').astype(np.int64)
+
+
+_columns = None
+_stamp = None
+# Refresh at most this often per worker; queries in between use the snapshot
+REFRESH_INTERVAL = 5.0
+
+
+def _stamp_path():
+    return os.path.join(current_app.instance_path, 'click_analytics.stamp')
+
+
+def _read_stamp():
+    try:
+        return os.stat(_stamp_path()).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_columns():
+    """Per-worker snapshot, refreshed incrementally when it is stale and
+    reloaded from scratch after `invalidate()`."""
+    global _columns, _stamp
+    stamp = _read_stamp()
+    if _columns is None:
+        _columns = ClickColumns()
+    elif stamp != _stamp:
+        _columns.reset()
+    _stamp = stamp
+    if _columns.refreshed_at is None or time.monotonic() - _columns.refreshed_at > REFRESH_INTERVAL:
+        _columns.refresh()
+    return _columns
+
+
+def invalidate():
+    """Tell every worker to reload its snapshot, e.g. after clicks were
+    deleted or moved (the incremental refresh only sees new clicks)."""
+    path = _stamp_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        pass
+    os.utime(path, ns=(time.time_ns(), time.time_ns()))
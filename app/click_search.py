@@ -0,0 +1,178 @@
+"""Text and IP prefix search over link clicks.
+
+On SQLite the user agent, city and region are indexed by an FTS5
+external-content table kept in sync by triggers, so every insert path
+(including bulk inserts) is indexed. On PostgreSQL a pg_trgm GIN index
+over the same text serves ILIKE searches. IP prefixes and CIDR blocks
+are matched as ranges on the packed visitor_ip_bin index.
+"""
+import re
+from sqlalchemy import text
+from . import db
+from .models.link_tracking import LinkClick, IPV4_MAPPED_PREFIX, ip_network_range, pack_ip
+
+FTS_TABLE = 'link_click_fts'
+
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "user_agent, city, region, content='link_click', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS link_click_fts_ai AFTER INSERT ON link_click BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, user_agent, city, region) "
+    "VALUES (new.id, new.user_agent, new.city, new.region); END",
+    f"CREATE TRIGGER IF NOT EXISTS link_click_fts_ad AFTER DELETE ON link_click BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_agent, city, region) "
+    "VALUES ('delete', old.id, old.user_agent, old.city, old.region); END",
+    f"CREATE TRIGGER IF NOT EXISTS link_click_fts_au AFTER UPDATE OF user_agent, city, region "
+    "ON link_click BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_agent, city, region) "
+    "VALUES ('delete', old.id, old.user_agent, old.city, old.region); "
+    f"INSERT INTO {FTS_TABLE}(rowid, user_agent, city, region) "
+    "VALUES (new.id, new.user_agent, new.city, new.region); END",
+]
+
+# Must match the expression of the trigram index so PostgreSQL can use it
+SEARCH_TEXT_SQL = "(coalesce(user_agent, '') || ' ' || coalesce(city, '') || ' ' || coalesce(region, ''))"
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_link_click_search_trgm ON link_click "
+    f"USING gin ({SEARCH_TEXT_SQL} gin_trgm_ops)",
+]
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def rebuild_index():
+    """Create the search index if it is missing and re-index every click."""
+    if _dialect() == 'sqlite':
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    elif _dialect() == 'postgresql':
+        for statement in POSTGRES_DDL:
+            db.session.execute(text(statement))
+    db.session.commit()
+
+
+def _terms(q):
+    return [t for t in re.split(r'\s+', q.strip()) if t]
+
+
+def _fts_query(terms):
+    # Quote every term so FTS5 syntax in user input is taken literally,
+    # and match it as a prefix
+    return ' AND '.join('"{}"*'.format(t.replace('"', '""')) for t in terms)
+
+
+def apply_text_search(query, q):
+    """Restrict a LinkClick query to clicks whose user agent, city or region
+    contain every term of q."""
+    terms = _terms(q)
+    if not terms:
+        return query
+
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        matches = text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts")\
+            .bindparams(fts=_fts_query(terms))\
+            .columns(rowid=db.Integer)
+        return query.filter(LinkClick.id.in_(matches.scalar_subquery()))
+
+    # The trigram index serves these ILIKEs on PostgreSQL; elsewhere they scan
+    search_text = db.literal_column(SEARCH_TEXT_SQL)
+    for term in terms:
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(search_text.ilike(f'%{escaped}%', escape='\\'))
+    return query
+
+
+IPV4_PREFIX = re.compile(r'(\d{1,3}\.){0,3}\d{0,3}')
+
+
+def _ipv4_prefix_ranges(prefix):
+    """Packed (low, high) ranges covering the IPv4 addresses whose dotted
+    text starts with prefix, e.g. 203.0.11 is 203.0.11.* and 203.0.110-119.*"""
+    *octets, partial = prefix.split('.')
+    if any(int(o) > 255 or (len(o) > 1 and o.startswith('0')) for o in octets):
+        return []
+    # Values the partial octet can take, as runs of consecutive numbers
+    runs = []
+    for value in range(256):
+        if str(value).startswith(partial):
+            if runs and runs[-1][1] == value - 1:
+                runs[-1][1] = value
+            else:
+                runs.append([value, value])
+
+    rest = 3 - len(octets)
+    head = bytes(int(o) for o in octets)
+    return [(IPV4_MAPPED_PREFIX + head + bytes([low]) + b'\x00' * rest,
+             IPV4_MAPPED_PREFIX + head + bytes([high]) + b'\xff' * rest)
+            for low, high in runs]
+
+
+IPV6_PREFIX = re.compile(r'([0-9a-f]{1,4}:){0,7}[0-9a-f]{0,4}')
+
+
+def _ipv6_group_runs(partial):
+    """Ranges of 16-bit group values whose hex text starts with partial"""
+    if not partial:
+        return [(0, 0xffff)]
+    if partial.startswith('0'):
+        return [(0, 0)] if partial == '0' else []
+    value = int(partial, 16)
+    return [(value << 4 * k, (value << 4 * k) + 16 ** k - 1) for k in range(5 - len(partial))]
+
+
+def _ipv6_prefix_ranges(prefix):
+    """Packed (low, high) ranges covering the IPv6 addresses whose leading
+    groups, written out in full, start with prefix (2001:db8 or 2001:db8::
+    are 2001:db8:*). Other forms with :: only match that exact address."""
+    prefix = prefix.lower()
+    if prefix.endswith('::') and prefix.count('::') == 1:
+        prefix = prefix[:-1]
+    if not IPV6_PREFIX.fullmatch(prefix):
+        packed = pack_ip(prefix)
+        return [(packed, packed)] if packed else []
+
+    *groups, partial = prefix.split(':')
+    head = b''.join(int(g, 16).to_bytes(2, 'big') for g in groups)
+    rest = 7 - len(groups)
+    return [(head + low.to_bytes(2, 'big') + b'\x00\x00' * rest,
+             head + high.to_bytes(2, 'big') + b'\xff\xff' * rest)
+            for low, high in _ipv6_group_runs(partial)]
+
+
+def apply_ip_prefix(query, prefix):
+    """Restrict a LinkClick query to visitor IPs starting with prefix.
+
+    Prefixes of digits and dots are IPv4, anything with a colon IPv6; both
+    become ranges on the visitor_ip_bin index. Values that aren't IP
+    addresses (and any not yet packed by `flask clicks backfill-ip`) are
+    compared as text, which scans.
+    """
+    prefix = (prefix or '').strip()
+    if not prefix:
+        return query
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    as_text = db.and_(LinkClick.visitor_ip_text >= prefix, LinkClick.visitor_ip_text < upper)
+    if IPV4_PREFIX.fullmatch(prefix):
+        ranges = _ipv4_prefix_ranges(prefix)
+    elif ':' in prefix:
+        ranges = _ipv6_prefix_ranges(prefix)
+    else:
+        return query.filter(as_text)
+
+    ranges = [LinkClick.visitor_ip_bin.between(low, high) for low, high in ranges]
+    return query.filter(db.or_(*ranges, db.and_(LinkClick.visitor_ip_bin.is_(None), as_text)))
+
+
+def apply_ip_network(query, network):
+    """Restrict a LinkClick query to visitor IPs inside a CIDR block.
+
+    Raises ValueError if network isn't a valid CIDR block.
+    """
+    low, high = ip_network_range(network)
+    return query.filter(LinkClick.visitor_ip_bin.between(low, high))
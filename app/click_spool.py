@@ -0,0 +1,290 @@
+"""Append-only on-disk spool for referral clicks.
+
+The redirect path appends one record per click to a per-process segment
+file, so a click is never lost when the database is down or locked. The
+loader (`flask clicks load-spool`) bulk-inserts the records into
+link_click and keeps a checkpoint of how far it got in every segment.
+
+Segment layout: a sequence of records, each a 4-byte big-endian payload
+length, a 4-byte CRC32 of the payload, then the JSON payload. Segments
+being written end in `.open` and are renamed to `.seg` once full.
+
+Loading is at-least-once: a crash between the insert commit and the
+checkpoint write re-inserts that chunk on the next run. Only one loader
+runs at a time: it holds an fcntl lock on `load.lock` in the spool
+directory, and a second loader returns without reading anything.
+
+In fallback mode a failed database write opens a per-process breaker
+(`WriteBreaker`): for CLICK_SPOOL_COOLDOWN seconds clicks go straight to
+the spool instead of each waiting out the driver timeout.
+"""
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: nothing stops two loaders running at once
+    fcntl = None
+
+HEADER = struct.Struct('>II')
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+CHECKPOINT_NAME = 'checkpoint.json'
+LOCK_NAME = 'load.lock'
+SEGMENT_BYTES = 16 * 1024 * 1024
+LOAD_CHUNK = 5000
+
+
+class ClickSpool:
+    """Per-process segment writer with group-commit fsync.
+
+    Writers append under a short lock, then wait for an fsync that covers
+    their record. Whoever gets the sync lock first fsyncs for everyone
+    who appended before it, so concurrent clicks share one fsync.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._path = None
+        self._size = 0
+        self._written = 0
+        self._synced = 0
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        name = f'{time.time_ns():020d}-{self._pid}{OPEN_SUFFIX}'
+        self._path = os.path.join(self.directory, name)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+
+    def _seal_segment(self):
+        os.fsync(self._fd)
+        os.close(self._fd)
+        os.rename(self._path, self._path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self._synced = self._written
+        self._fd = None
+
+    def append(self, record):
+        """Durably append one record (a JSON-serialisable dict)."""
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        data = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._write_lock:
+            if self._pid != os.getpid():
+                # Forked (e.g. gunicorn --preload): never share the parent's segment
+                self._fd = None
+                self._written = self._synced = 0
+            if self._fd is None:
+                self._open_segment()
+            elif self._size + len(data) > self.segment_bytes:
+                self._seal_segment()
+                self._open_segment()
+            os.write(self._fd, data)
+            self._size += len(data)
+            self._written += 1
+            seq = self._written
+
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._write_lock:
+                fd, target = self._fd, self._written
+            os.fsync(fd)
+            self._synced = max(self._synced, target)
+
+    def close(self):
+        with self._write_lock:
+            if self._fd is not None and self._pid == os.getpid():
+                self._seal_segment()
+
+
+def read_records(path, offset):
+    """Yield (record, end_offset) for every complete record after offset.
+
+    Stops at a partially written record; raises ValueError on a CRC mismatch.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    pos = 0
+    while pos + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, pos)
+        end = pos + HEADER.size + length
+        if end > len(data):
+            break
+        payload = data[pos + HEADER.size:end]
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f'Corrupt record at offset {offset + pos} in {path}')
+        yield json.loads(payload), offset + end
+        pos = end
+
+
+def _writer_alive(stem):
+    try:
+        pid = int(stem.rsplit('-', 1)[1])
+        os.kill(pid, 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_checkpoint(directory):
+    try:
+        with open(os.path.join(directory, CHECKPOINT_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_checkpoint(directory, checkpoint):
+    path = os.path.join(directory, CHECKPOINT_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _click_rows(records):
+    """Resolve unique links to users and enrich records into link_click rows."""
+    from . import db
+    from .models.link_tracking import LinkClick
+    from .models.user import User
+
+    links = {r['unique_link'] for r in records}
+    user_ids = dict(db.session.query(User.unique_link, User.id).filter(User.unique_link.in_(links)))
+    rows = []
+    for r in records:
+        user_id = user_ids.get(r['unique_link'])
+        if user_id is None:
+            continue
+        rows.append(LinkClick.enriched_row(
+            user_id, r.get('visitor_ip'), r.get('user_agent'), datetime.fromisoformat(r['timestamp'])
+        ))
+    return rows
+
+
+def load_spool(directory, chunk_size=LOAD_CHUNK):
+    """Insert all spooled clicks into link_click.
+
+    Returns a dict with the number of records read and clicks inserted,
+    and whether another loader held the lock (`busy`).
+    """
+    if not os.path.isdir(directory):
+        return {'records': 0, 'inserted': 0, 'busy': False}
+
+    fd = os.open(os.path.join(directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return {'records': 0, 'inserted': 0, 'busy': True}
+        # The lock goes away with the descriptor
+        return dict(_load(directory, chunk_size), busy=False)
+    finally:
+        os.close(fd)
+
+
+def _load(directory, chunk_size):
+    from . import db
+    from .models.link_tracking import LinkClick, ClickFacet
+
+    checkpoint = _read_checkpoint(directory)
+    names = sorted(n for n in os.listdir(directory)
+                   if n.endswith(OPEN_SUFFIX) or n.endswith(SEALED_SUFFIX))
+    total_records = total_inserted = 0
+
+    def flush(stem, records, offset):
+        nonlocal total_records, total_inserted
+        rows = _click_rows(records)
+        if rows:
+            db.session.execute(insert(LinkClick), rows)
+            ClickFacet.record(rows)
+        db.session.commit()
+        checkpoint[stem] = offset
+        _write_checkpoint(directory, checkpoint)
+        total_records += len(records)
+        total_inserted += len(rows)
+
+    for name in names:
+        # Checkpoints are keyed by the stem so sealing a segment keeps its offset
+        stem = name.rsplit('.', 1)[0]
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            name = stem + SEALED_SUFFIX
+            path = os.path.join(directory, name)
+        finished = name.endswith(SEALED_SUFFIX) or not _writer_alive(stem)
+        offset = checkpoint.get(stem, 0)
+        records = []
+        try:
+            for record, end in read_records(path, offset):
+                records.append(record)
+                offset = end
+                if len(records) >= chunk_size:
+                    flush(stem, records, offset)
+                    records = []
+        except ValueError as e:
+            if not finished:
+                raise
+            # The writer is gone, nothing after the bad record can be trusted
+            print(f'{e}; skipping the rest of the segment')
+        if records:
+            flush(stem, records, offset)
+
+        if finished:
+            os.remove(path)
+            checkpoint.pop(stem, None)
+            _write_checkpoint(directory, checkpoint)
+
+    return {'records': total_records, 'inserted': total_inserted}
+
+
+class WriteBreaker:
+    """Circuit breaker for the click write in fallback mode.
+
+    `trip()` after a failed write opens it for `cooldown` seconds; while it
+    is open the redirect spools without touching the database. The first
+    click after the cooldown tries the database again.
+    """
+
+    def __init__(self, cooldown):
+        self.cooldown = cooldown
+        self._open_until = 0.0
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self._open_until
+
+    def trip(self):
+        self._open_until = time.monotonic() + self.cooldown
+
+
+def get_spool():
+    return current_app.extensions['click_spool']
+
+
+def get_breaker():
+    return current_app.extensions['click_breaker']
+
+
+def init_app(app):
+    directory = app.config.get('CLICK_SPOOL_DIR') or os.path.join(app.instance_path, 'click_spool')
+    app.extensions['click_spool'] = ClickSpool(directory)
+    app.extensions['click_breaker'] = WriteBreaker(app.config.get('CLICK_SPOOL_COOLDOWN', 30))
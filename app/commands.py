@@ -0,0 +1,135 @@
+import time
+import click
+
+
+@click.group('clicks')
+def clicks_cli():
+    """Click storage and indexing commands."""
+
+
+@clicks_cli.command('load-spool')
+@click.option('--follow', is_flag=True, help='Keep running and load new clicks as they arrive.')
+@click.option('--interval', default=2.0, show_default=True, help='Seconds between passes with --follow.')
+def load_spool_command(follow, interval):
+    """Bulk-insert spooled clicks into link_click."""
+    from .click_spool import get_spool, load_spool
+    directory = get_spool().directory
+    while True:
+        result = load_spool(directory)
+        if result['busy']:
+            if not follow:
+                print('Another loader is running, nothing loaded')
+                break
+        elif result['records'] or not follow:
+            print(f"Loaded {result['inserted']} click(s) from {result['records']} spooled record(s)")
+        if not follow:
+            break
+        time.sleep(interval)
+
+
+@clicks_cli.command('rebuild-facets')
+def rebuild_facets_command():
+    """Recompute the click filter facets from link_click."""
+    from .models.link_tracking import ClickFacet
+    ClickFacet.rebuild()
+    print('Click facets rebuilt')
+
+
+@clicks_cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Create the click search index if missing and re-index all clicks."""
+    from .click_search import rebuild_index
+    rebuild_index()
+    print('Click search index rebuilt')
+
+
+@clicks_cli.command('backfill-ip')
+@click.option('--chunk-size', default=10000, show_default=True, help='Rows converted per transaction.')
+def backfill_ip_command(chunk_size):
+    """Pack visitor IPs still stored as text (e.g. recorded by an older
+    worker during a deploy)."""
+    from sqlalchemy import update
+    from . import db
+    from .models.link_tracking import LinkClick, ip_columns
+
+    last_id = converted = 0
+    while True:
+        rows = db.session.query(LinkClick.id, LinkClick.visitor_ip_text)\
+            .filter(LinkClick.id > last_id)\
+            .filter(LinkClick.visitor_ip_bin.is_(None))\
+            .filter(LinkClick.visitor_ip_text.isnot(None))\
+            .order_by(LinkClick.id)\
+            .limit(chunk_size)\
+            .all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        values = [{'id': r.id, **ip_columns(r.visitor_ip_text)} for r in rows]
+        values = [v for v in values if v['visitor_ip_bin'] is not None]
+        if values:
+            db.session.execute(update(LinkClick), values)
+        db.session.commit()
+        converted += len(values)
+        print(f'Converted {converted} address(es), up to click {last_id}')
+    print(f'Backfill complete: {converted} address(es) converted')
+
+
+@clicks_cli.command('ip-storage-report')
+def ip_storage_report_command():
+    """Compare the storage used by text and binary visitor IPs."""
+    from sqlalchemy import text
+    from . import db
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        column_sql = 'SELECT count({0}), coalesce(sum(length({0})), 0) FROM link_click'
+        index_sql = "SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name = :name"
+    elif dialect == 'postgresql':
+        column_sql = 'SELECT count({0}), coalesce(sum(pg_column_size({0})), 0) FROM link_click'
+        index_sql = "SELECT coalesce(pg_relation_size(to_regclass(:name)), 0)"
+    else:
+        print(f'Not supported on {dialect}')
+        return
+
+    for column in ('visitor_ip', 'visitor_ip_bin'):
+        rows, column_bytes = db.session.execute(text(column_sql.format(column))).one()
+        index_bytes = db.session.execute(text(index_sql), {'name': f'ix_link_click_{column}'}).scalar()
+        per_row = column_bytes / rows if rows else 0
+        print(f'{column}: {rows} row(s), {column_bytes} column bytes ({per_row:.1f}/row), '
+              f'{index_bytes} index bytes')
+
+
+@click.group('bench')
+def bench_cli():
+    """Synthetic data and analytics query benchmarks."""
+
+
+@bench_cli.command('seed')
+@click.option('--clicks', default=1000000, show_default=True, help='Number of clicks to generate.')
+@click.option('--reps', default=50, show_default=True, help='Number of bench sales reps.')
+@click.option('--days', default=90, show_default=True, help='Days of history to spread clicks over.')
+@click.option('--seed', 'random_seed', default=42, show_default=True, help='Random seed.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per insert batch.')
+def bench_seed_command(clicks, reps, days, random_seed, batch_size):
+    """Bulk-load a deterministic synthetic click history."""
+    from . import bench
+    bench.seed(clicks, reps=reps, days=days, seed=random_seed, batch_size=batch_size)
+
+
+@bench_cli.command('run')
+@click.option('--repeat', default=3, show_default=True, help='Timed runs per query.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the JSON report to a file.')
+def bench_run_command(repeat, output):
+    """Time every analytics query and report the results as JSON."""
+    import json
+    from . import bench
+    report = json.dumps(bench.run(repeat=repeat), indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+
+def init_app(app):
+    app.cli.add_command(clicks_cli)
+    app.cli.add_command(bench_cli)
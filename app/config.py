@@ -20,3 +20,52 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # User import
+    # Most rows the web upload accepts; at ~150 ms per password hash larger
+    # files would outlast the worker timeout, so they go through `flask users import`
+    USER_IMPORT_MAX_UPLOAD_ROWS = int(os.environ.get('USER_IMPORT_MAX_UPLOAD_ROWS') or 100)
+
+    # Startup
+    # Compiled templates are shared by every worker through this directory
+    # (defaults to instance/jinja_cache)
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    # Compile all templates (and load GeoIP/user agent tables) before serving
+    WARM_START = os.environ.get('WARM_START', '').lower() in ('1', 'true', 'yes')
+
+    # Click spool
+    # Directory for spooled clicks (defaults to instance/click_spool)
+    CLICK_SPOOL_DIR = os.environ.get('CLICK_SPOOL_DIR')
+    # 'fallback' spools a click only when the database write fails,
+    # 'always' spools every click and leaves inserts to `flask clicks load-spool`
+    CLICK_SPOOL_MODE = os.environ.get('CLICK_SPOOL_MODE') or 'fallback'
+    # Seconds a worker spools without trying the database after a failed
+    # click write in fallback mode
+    CLICK_SPOOL_COOLDOWN = float(os.environ.get('CLICK_SPOOL_COOLDOWN') or 30)
+
+    # Link routing
+    # Seconds before a worker rebuilds its route table even without a change
+    ROUTE_TABLE_TTL = int(os.environ.get('ROUTE_TABLE_TTL') or 30)
+
+    # Async redirect service (app.async_redirect)
+    # Database connections each service process keeps open, plus how many
+    # more it may open during bursts
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE') or 10)
+    ASYNC_DB_MAX_OVERFLOW = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW') or 20)
+
+    # User deletion
+    # Clicks deleted (or moved) per transaction when a user is deleted
+    USER_DELETE_BATCH_SIZE = int(os.environ.get('USER_DELETE_BATCH_SIZE') or 5000)
+
+    # Redirect rate limiting
+    # Clicks from one IP, or to one link, beyond these token buckets are
+    # redirected but not recorded
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    # Shared bucket table (defaults to instance/rate_limit.table)
+    RATE_LIMIT_FILE = os.environ.get('RATE_LIMIT_FILE')
+    RATE_LIMIT_SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS') or 65536)
+    # Tokens per second and bucket size
+    RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE') or 1)
+    RATE_LIMIT_IP_BURST = int(os.environ.get('RATE_LIMIT_IP_BURST') or 30)
+    RATE_LIMIT_LINK_RATE = float(os.environ.get('RATE_LIMIT_LINK_RATE') or 50)
+    RATE_LIMIT_LINK_BURST = int(os.environ.get('RATE_LIMIT_LINK_BURST') or 1000)
@@ -0,0 +1,78 @@
+"""Click enrichment (device type and GeoIP lookups).
+
+The user agent regex tables and the GeoIP database are expensive to load,
+so they are imported on first use instead of when the app starts.
+"""
+from functools import lru_cache
+
+GEOIP_DATABASE = 'GeoLite2-City.mmdb'
+
+_ua_parse = None
+_geo_reader = None
+_geo_reader_loaded = False
+
+
+def _get_ua_parse():
+    global _ua_parse
+    if _ua_parse is None:
+        from user_agents import parse
+        _ua_parse = parse
+    return _ua_parse
+
+
+def get_geo_reader():
+    """Open the GeoIP database once per process, or return None if unavailable."""
+    global _geo_reader, _geo_reader_loaded
+    if not _geo_reader_loaded:
+        try:
+            import geoip2.database
+            _geo_reader = geoip2.database.Reader(GEOIP_DATABASE)
+        except Exception:
+            _geo_reader = None
+        _geo_reader_loaded = True
+    return _geo_reader
+
+
+@lru_cache(maxsize=4096)
+def device_type(user_agent_string):
+    """Classify a user agent as desktop/mobile/tablet. Cached, since most
+    clicks come from a few hundred browser builds."""
+    if not user_agent_string:
+        return None
+    user_agent = _get_ua_parse()(user_agent_string)
+    if user_agent.is_mobile:
+        return 'mobile'
+    if user_agent.is_tablet:
+        return 'tablet'
+    return 'desktop'
+
+
+def geo_lookup(ip):
+    """Return (country, city, region) for an IP, with None for anything unknown"""
+    reader = get_geo_reader()
+    if not reader or not ip:
+        return None, None, None
+    try:
+        geo_data = reader.city(ip)
+        return (geo_data.country.iso_code,
+                geo_data.city.name,
+                geo_data.subdivisions.most_specific.name)
+    except Exception:
+        # If IP lookup fails, continue without geo data
+        return None, None, None
+
+
+def client_ip(forwarded_for, remote_addr):
+    """Visitor IP, preferring the first X-Forwarded-For address (for proxy
+    scenarios like Ngrok) over the socket address"""
+    visitor_ip = forwarded_for or remote_addr
+    if visitor_ip and ',' in visitor_ip:
+        # If multiple IPs in X-Forwarded-For, take the first one (original client)
+        visitor_ip = visitor_ip.split(',')[0].strip()
+    return visitor_ip
+
+
+def preload():
+    """Load the enrichment tables up front (e.g. in a gunicorn master before forking)."""
+    _get_ua_parse()
+    get_geo_reader()
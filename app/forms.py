@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, SubmitField, HiddenField
-from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, BooleanField, SubmitField, HiddenField, SelectField, DateTimeLocalField
+from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, ValidationError
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -61,3 +62,28 @@ class RedirectUrlForm(FlaskForm):
         Length(max=500, message='URL must be less than 500 characters')
     ])
     submit = SubmitField('Update Redirect URL')
+
+class UserImportForm(FlaskForm):
+    csv_file = FileField('CSV File', validators=[
+        FileRequired(),
+        FileAllowed(['csv'], message='Please upload a .csv file')
+    ])
+    submit = SubmitField('Import Users')
+
+class LinkRouteForm(FlaskForm):
+    name = StringField('Campaign Name', validators=[
+        DataRequired(),
+        Length(max=100, message='Name must be less than 100 characters')
+    ])
+    user_id = SelectField('Sales Rep', coerce=int)
+    url = StringField('Redirect URL', validators=[
+        DataRequired(),
+        Length(max=500, message='URL must be less than 500 characters')
+    ])
+    starts_at = DateTimeLocalField('Starts (UTC)', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    ends_at = DateTimeLocalField('Ends (UTC)', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    submit = SubmitField('Add Route')
+
+    def validate_ends_at(self, field):
+        if field.data and self.starts_at.data and field.data <= self.starts_at.data:
+            raise ValidationError('End must be after the start')
@@ -1,7 +1,12 @@
 from datetime import datetime
+import ipaddress
 import re
-from user_agents import parse
+import threading
+import time
+from collections import Counter
+from sqlalchemy.exc import SQLAlchemyError
 from .. import db
+from .. import enrichment
 
 class GlobalRedirect(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,22 +21,82 @@ class GlobalRedirect(db.Model):
         self.redirect_url = redirect_url
 
     @classmethod
-    def get_active_url(cls):
-        active_redirect = cls.query.filter_by(is_active=True).order_by(cls.created_at.desc()).first()
-        if not active_redirect:
+    def active_url_query(cls):
+        return db.select(cls.redirect_url).filter_by(is_active=True).order_by(cls.created_at.desc()).limit(1)
+
+    @staticmethod
+    def normalize_url(url):
+        if not url:
             return '/'
         # Ensure URL has protocol prefix
-        url = active_redirect.redirect_url
         if not re.match(r'^https?://', url):
             url = 'https://' + url
         return url
 
+    @classmethod
+    def get_active_url(cls):
+        return cls.normalize_url(db.session.execute(cls.active_url_query()).scalar())
+
+class LinkRoute(db.Model):
+    """Destination override for one rep's link (user_id set) or for every
+    rep's link (user_id NULL), optionally limited to an activation window."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)  # Campaign name
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    redirect_url = db.Column(db.String(500), nullable=False)
+    starts_at = db.Column(db.DateTime)  # NULL = active immediately
+    ends_at = db.Column(db.DateTime)  # NULL = no end
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Ensure URL has protocol prefix
+        if self.redirect_url and not re.match(r'^https?://', self.redirect_url):
+            self.redirect_url = 'https://' + self.redirect_url
+
+IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+def pack_ip(value):
+    """IP address as 16 bytes (IPv4 mapped into IPv6), or None if it isn't one"""
+    try:
+        ip = ipaddress.ip_address(value.strip())
+    except (ValueError, AttributeError):
+        return None
+    if ip.version == 4:
+        return IPV4_MAPPED_PREFIX + ip.packed
+    return ip.packed
+
+def unpack_ip(packed):
+    """Text form of a pack_ip value"""
+    if packed[:12] == IPV4_MAPPED_PREFIX:
+        return str(ipaddress.IPv4Address(packed[12:]))
+    return str(ipaddress.IPv6Address(packed))
+
+def ip_columns(value):
+    """link_click values for a visitor IP: only the packed form for IP
+    addresses, the text for anything else"""
+    packed = pack_ip(value)
+    return {'visitor_ip_bin': packed, 'visitor_ip_text': None if packed else value}
+
+def ip_network_range(network):
+    """First and last packed address of a CIDR block such as 203.0.113.0/24.
+    Raises ValueError if it isn't a valid network."""
+    net = ipaddress.ip_network(network.strip(), strict=False)
+    return pack_ip(str(net.network_address)), pack_ip(str(net.broadcast_address))
+
 class LinkClick(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    visitor_ip = db.Column(db.String(45))  # IPv6 compatible
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # Visitor IPs are stored packed (16 bytes, IPv4 mapped into IPv6) for
+    # IP searches and cheap distinct counts; the text column only holds
+    # values that aren't IP addresses. Read and set both via visitor_ip.
+    visitor_ip_bin = db.Column(db.LargeBinary(16), index=True)
+    visitor_ip_text = db.Column('visitor_ip', db.String(45))
     user_agent = db.Column(db.String(255))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Geographic data
     country = db.Column(db.String(2))  # ISO country code
@@ -44,21 +109,43 @@ class LinkClick(db.Model):
     # Relationships
     user = db.relationship('User', backref=db.backref('link_clicks', lazy='dynamic'))
     
+    @classmethod
+    def enriched_row(cls, user_id, visitor_ip, user_agent, timestamp):
+        """A link_click row with device, geographic and packed IP data filled in"""
+        country, city, region = enrichment.geo_lookup(visitor_ip)
+        return {
+            'user_id': user_id,
+            **ip_columns(visitor_ip),
+            'user_agent': user_agent,
+            'timestamp': timestamp,
+            'country': country,
+            'city': city,
+            'region': region,
+            'device_type': enrichment.device_type(user_agent),
+        }
+
+    @property
+    def visitor_ip(self):
+        if self.visitor_ip_bin:
+            return unpack_ip(self.visitor_ip_bin)
+        return self.visitor_ip_text
+
+    @visitor_ip.setter
+    def visitor_ip(self, value):
+        for key, column_value in ip_columns(value).items():
+            setattr(self, key, column_value)
+
     def set_device_type(self):
         """Parse user agent and set device type"""
         if self.user_agent:
-            user_agent = parse(self.user_agent)
-            if user_agent.is_mobile:
-                self.device_type = 'mobile'
-            elif user_agent.is_tablet:
-                self.device_type = 'tablet'
-            else:
-                self.device_type = 'desktop'
+            self.device_type = enrichment.device_type(self.user_agent)
 
     @classmethod
     def get_stats_for_user(cls, user_id):
         total_clicks = cls.query.filter_by(user_id=user_id).count()
-        unique_ips = db.session.query(db.func.count(db.distinct(cls.visitor_ip))).filter_by(user_id=user_id).scalar()
+        # Values that aren't IP addresses have no packed form: count their text
+        visitor = db.func.coalesce(cls.visitor_ip_bin, db.cast(cls.visitor_ip_text, db.LargeBinary))
+        unique_ips = db.session.query(db.func.count(db.distinct(visitor))).filter_by(user_id=user_id).scalar()
         last_click = cls.query.filter_by(user_id=user_id).order_by(cls.timestamp.desc()).first()
         
         # Get device type breakdown
@@ -104,3 +191,152 @@ class LinkClick(db.Model):
             'country_breakdown': country_breakdown,
             'city_breakdown': city_breakdown
         }
+
+
+class ClickFacet(db.Model):
+    """Running click counts per distinct country, device type and user, kept
+    up to date as clicks are written so filter dropdowns never scan link_click.
+
+    Bulk writers (spool loader, deletions) update the counts in their own
+    transaction with record(). The redirect path defers them per worker
+    and flushes every FLUSH_INTERVAL, so a worker killed outright loses at
+    most that many seconds of counts (`flask clicks rebuild-facets` repairs
+    any drift).
+    """
+    facet = db.Column(db.String(20), primary_key=True)  # country/device_type/user_id
+    value = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    FACETS = ('country', 'device_type', 'user_id')
+    CACHE_TTL = 10  # seconds a worker reuses its copy of the facets
+    # Seconds the redirect path collects counts per worker before writing
+    # them, so concurrent clicks don't queue on the same few facet rows
+    FLUSH_INTERVAL = 2.0
+    _cache = None
+    _cached_at = 0.0
+    _pending = Counter()
+    _pending_lock = threading.Lock()
+    _flushed_at = 0.0
+
+    @classmethod
+    def _get(cls, click, facet):
+        return click.get(facet) if isinstance(click, dict) else getattr(click, facet)
+
+    @classmethod
+    def count_rows(cls, clicks, sign=1):
+        """Facet count deltas for clicks, as click_facet rows.
+
+        Rows come sorted by key so every writer locks facet rows in the same
+        order and concurrent upserts can't deadlock.
+        """
+        counts = Counter()
+        for click in clicks:
+            for facet in cls.FACETS:
+                value = cls._get(click, facet)
+                if value is not None:
+                    counts[(facet, str(value))] += 1
+        return [{'facet': f, 'value': v, 'count': n * sign} for (f, v), n in sorted(counts.items())]
+
+    @classmethod
+    def upsert_statement(cls, dialect):
+        """INSERT ... ON CONFLICT statement adding to the counts, or None if
+        the dialect has no upsert."""
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            return None
+        stmt = insert(cls)
+        return stmt.on_conflict_do_update(
+            index_elements=['facet', 'value'],
+            set_={'count': cls.count + stmt.excluded['count']}
+        )
+
+    @classmethod
+    def record(cls, clicks, sign=1):
+        """Add (or with sign=-1, remove) clicks in the current transaction.
+
+        clicks may be LinkClick objects or dicts of link_click columns.
+        """
+        cls._apply(cls.count_rows(clicks, sign))
+
+    @classmethod
+    def _apply(cls, rows):
+        if not rows:
+            return
+        stmt = cls.upsert_statement(db.session.get_bind().dialect.name)
+        if stmt is not None:
+            db.session.execute(stmt, rows)
+        else:
+            for row in rows:
+                facet = db.session.get(cls, (row['facet'], row['value']))
+                if facet:
+                    facet.count += row['count']
+                else:
+                    db.session.add(cls(**row))
+        cls._cache = None
+
+    @classmethod
+    def defer(cls, clicks):
+        """Count committed clicks in this worker, to be written by flush()."""
+        cls.restore(cls.count_rows(clicks))
+
+    @classmethod
+    def restore(cls, rows):
+        """Put rows taken by take_due() back, e.g. after a failed write."""
+        with cls._pending_lock:
+            for row in rows:
+                cls._pending[(row['facet'], row['value'])] += row['count']
+
+    @classmethod
+    def take_due(cls, force=False):
+        """The pending counts as sorted rows once FLUSH_INTERVAL has passed
+        since the last flush (or now, with force), clearing them."""
+        with cls._pending_lock:
+            now = time.monotonic()
+            if not cls._pending or (not force and now - cls._flushed_at < cls.FLUSH_INTERVAL):
+                return []
+            rows = [{'facet': f, 'value': v, 'count': n} for (f, v), n in sorted(cls._pending.items()) if n]
+            cls._pending.clear()
+            cls._flushed_at = now
+        return rows
+
+    @classmethod
+    def flush(cls, force=False):
+        """Write the counts deferred in this worker in their own transaction,
+        if they are due. Counts that can't be written are kept for next time."""
+        rows = cls.take_due(force)
+        if not rows:
+            return
+        try:
+            cls._apply(rows)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            cls.restore(rows)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every facet from link_click (one full scan)."""
+        cls.query.delete()
+        for facet in cls.FACETS:
+            column = getattr(LinkClick, facet)
+            counts = db.session.query(column, db.func.count(LinkClick.id))\
+                .filter(column.isnot(None))\
+                .group_by(column)\
+                .all()
+            db.session.add_all(cls(facet=facet, value=str(v), count=n) for v, n in counts)
+        db.session.commit()
+        cls._cache = None
+
+    @classmethod
+    def get_all(cls):
+        """{facet: [(value, count), ...]} ordered by count, cached per worker."""
+        if cls._cache is not None and time.monotonic() - cls._cached_at < cls.CACHE_TTL:
+            return cls._cache
+        facets = {facet: [] for facet in cls.FACETS}
+        for row in cls.query.filter(cls.count > 0).order_by(cls.count.desc(), cls.value).all():
+            facets[row.facet].append((row.value, row.count))
+        cls._cache, cls._cached_at = facets, time.monotonic()
+        return facets
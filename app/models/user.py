@@ -44,6 +44,50 @@ class User(UserMixin, db.Model):
         self.reset_token_expiry = None
         db.session.commit()
 
+class UserDeletion(db.Model):
+    """Progress of a background user deletion (see app/user_deletion.py).
+
+    user_id is not a foreign key so the record outlives the user it deletes.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    user_email = db.Column(db.String(120))
+    reassign_to_id = db.Column(db.Integer)  # NULL = delete the clicks
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending/running/done/failed
+    clicks_total = db.Column(db.Integer, nullable=False, default=0)
+    clicks_done = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    UNFINISHED = ('pending', 'running')
+    OPEN = UNFINISHED + ('failed',)
+    # A running deletion that hasn't recorded progress for this long is
+    # assumed to have died with its process and may be claimed again
+    STALE_AFTER = timedelta(minutes=5)
+
+    @property
+    def stale(self):
+        return self.status == 'running' and self.updated_at is not None and \
+            datetime.utcnow() - self.updated_at > self.STALE_AFTER
+
+    @property
+    def retryable(self):
+        return self.status == 'failed' or self.stale
+
+    @property
+    def percent(self):
+        if not self.clicks_total:
+            return 100 if self.status == 'done' else 0
+        return min(100, int(self.clicks_done * 100 / self.clicks_total))
+
+    @classmethod
+    def get_open(cls):
+        """{user_id: deletion} for deletions still running or waiting to be retried"""
+        deletions = cls.query.filter(cls.status.in_(cls.OPEN))\
+            .order_by(cls.id).all()
+        return {d.user_id: d for d in deletions}
+
 @login_manager.user_loader
 def load_user(id):
     return User.query.get(int(id))
@@ -0,0 +1,223 @@
+"""Token-bucket admission control for the public redirect, shared by all
+worker processes.
+
+Every client IP and every rep's referral link has a token bucket. The
+IP is the connecting address (the proxy's entry in X-Forwarded-For, not
+the spoofable first one). A click is recorded only if both buckets have
+a token; otherwise the visitor is still redirected but the click is
+dropped, so a crawler loop or a single abusive client can't saturate
+database writes for everyone else.
+
+The buckets live in a memory-mapped file (RATE_LIMIT_FILE, by default
+instance/rate_limit.table) so all gunicorn workers, and the async
+redirect service, share them. The file is a fixed-size open-addressing
+hash table. Each slot holds a 64-bit key hash, the bucket's tokens and
+last update time, allowed/limited counters and the key itself
+(truncated) for metrics. A key that finds its PROBE_LIMIT slots taken
+evicts the least recently used one and starts with a full bucket.
+Updates take an fcntl lock on the whole file, held for a few
+microseconds.
+
+If the table can't be opened, every request is admitted.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: only threads of one process are coordinated
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RLT1'
+HEADER = struct.Struct('<4sI')
+HEADER_SIZE = 16
+# key hash, tokens, updated (epoch seconds), allowed, limited, key
+SLOT = struct.Struct('<QddQQ64s')
+PROBE_LIMIT = 16
+
+
+def _key_hash(key):
+    digest = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+    return digest or 1  # 0 marks an empty slot
+
+
+class RateLimiter:
+    def __init__(self, path, slots, rules):
+        # rules: {kind: (tokens per second, burst)}
+        self.path = path
+        self.slots = slots
+        self.rules = rules
+        self.size = HEADER_SIZE + slots * SLOT.size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._failed = False
+
+    def _create(self, fd):
+        os.ftruncate(fd, self.size)
+        os.pwrite(fd, HEADER.pack(MAGIC, self.slots), 0)
+
+    def _replace(self):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            self._create(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, self.path)
+
+    def _open(self):
+        # Opened lazily, and again after a fork, so every worker has its own mapping
+        if self._pid == os.getpid():
+            return self._map
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        for _ in range(3):
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.lockf(fd, fcntl.LOCK_EX)
+                magic, slots = HEADER.unpack(os.pread(fd, HEADER.size, 0).ljust(HEADER.size, b'\0'))
+                if magic != MAGIC:
+                    # New file: nobody has it mapped yet
+                    self._create(fd)
+                elif slots != self.slots or os.fstat(fd).st_size != self.size:
+                    # Table from before RATE_LIMIT_SLOTS changed, possibly still
+                    # mapped by old workers: swap in a new file rather than
+                    # resizing theirs under them, then open that
+                    self._replace()
+                    os.close(fd)
+                    continue
+                table = mmap.mmap(fd, self.size)
+                if fcntl:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+            except OSError:
+                os.close(fd)
+                raise
+            self._map, self._fd, self._pid = table, fd, os.getpid()
+            return table
+        raise OSError(f'Could not open rate limit table {self.path}')
+
+    def _locked(self, fn):
+        with self._lock:
+            try:
+                table = self._open()
+            except OSError:
+                if not self._failed:
+                    logger.exception('Rate limit table %s unavailable, admitting every request', self.path)
+                    self._failed = True
+                return None
+            if fcntl:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                return fn(table)
+            finally:
+                if fcntl:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _find_slot(self, table, key_hash):
+        """Offset of the key's slot, claiming (or evicting) one if needed.
+        Returns (offset, existing)."""
+        start = key_hash % self.slots
+        oldest, oldest_at = None, None
+        for i in range(PROBE_LIMIT):
+            offset = HEADER_SIZE + ((start + i) % self.slots) * SLOT.size
+            slot_hash, _, updated, _, _, _ = SLOT.unpack_from(table, offset)
+            if slot_hash == key_hash:
+                return offset, True
+            if slot_hash == 0:
+                return offset, False
+            if oldest is None or updated < oldest_at:
+                oldest, oldest_at = offset, updated
+        return oldest, False
+
+    def _take(self, table, kind, value, now):
+        rate, burst = self.rules[kind]
+        key = f'{kind}:{value}'.encode('utf-8', 'replace')
+        key_hash = _key_hash(key)
+        offset, existing = self._find_slot(table, key_hash)
+        if existing:
+            _, tokens, updated, allowed, limited, stored_key = SLOT.unpack_from(table, offset)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+        else:
+            tokens, allowed, limited, stored_key = float(burst), 0, 0, key[:64]
+
+        admitted = tokens >= 1
+        if admitted:
+            tokens -= 1
+            allowed += 1
+        else:
+            limited += 1
+        SLOT.pack_into(table, offset, key_hash, tokens, now, allowed, limited, stored_key)
+        return admitted
+
+    def allow(self, ip, link=None):
+        """Take a token from the IP's and the link's buckets. False if
+        either is empty (the link's isn't charged when the IP's is).
+        A None ip or link has no bucket."""
+        def take(table):
+            now = time.time()
+            if ip and not self._take(table, 'ip', ip, now):
+                return False
+            return not link or self._take(table, 'link', link, now)
+
+        admitted = self._locked(take)
+        return True if admitted is None else admitted
+
+    def stats(self, limit=100):
+        """Counters per key, most limited first, and table occupancy."""
+        def read(table):
+            # Only copy under the lock: every redirect waits on it
+            return table[HEADER_SIZE:self.size]
+
+        data = self._locked(read) or b''
+        keys = []
+        for key_hash, tokens, updated, allowed, limited, key in SLOT.iter_unpack(data):
+            if key_hash:
+                keys.append({
+                    'key': key.rstrip(b'\0').decode('utf-8', 'replace'),
+                    'allowed': allowed,
+                    'limited': limited,
+                    'tokens': round(tokens, 2),
+                    'updated_at': updated,
+                })
+        keys.sort(key=lambda k: (k['limited'], k['allowed']), reverse=True)
+        return {
+            'enabled': True,
+            'slots': self.slots,
+            'slots_used': len(keys),
+            'allowed': sum(k['allowed'] for k in keys),
+            'limited': sum(k['limited'] for k in keys),
+            'keys': keys[:limit],
+        }
+
+
+class _Unlimited:
+    def allow(self, ip, link=None):
+        return True
+
+    def stats(self, limit=100):
+        return {'enabled': False}
+
+
+def get_limiter(app):
+    return app.extensions['rate_limiter']
+
+
+def init_app(app):
+    config = app.config
+    if not config['RATE_LIMIT_ENABLED']:
+        app.extensions['rate_limiter'] = _Unlimited()
+        return
+    path = config.get('RATE_LIMIT_FILE') or os.path.join(app.instance_path, 'rate_limit.table')
+    app.extensions['rate_limiter'] = RateLimiter(path, config['RATE_LIMIT_SLOTS'], {
+        'ip': (config['RATE_LIMIT_IP_RATE'], config['RATE_LIMIT_IP_BURST']),
+        'link': (config['RATE_LIMIT_LINK_RATE'], config['RATE_LIMIT_LINK_BURST']),
+    })
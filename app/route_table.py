@@ -0,0 +1,186 @@
+"""Compiled in-memory table of referral link destinations.
+
+The table maps each rep's unique link to its candidate destinations,
+most specific first, so resolving a redirect is one dict lookup plus a
+check of the (few) activation windows for that link, however many routes
+exist. It is rebuilt from the database into a new object and swapped in
+with a single assignment, so requests never see a half-built table.
+
+The table also holds the set of every rep's unique link, so the rate
+limiter only keeps buckets for links that exist. A rep created since the
+last rebuild isn't in it until the next one.
+
+Workers notice admin changes through the mtime of a stamp file that
+`invalidate()` touches; the table is also rebuilt every ROUTE_TABLE_TTL
+seconds for deployments where workers don't share a filesystem. Rebuilds
+run in a background thread while requests keep using the previous table,
+so an admin change takes effect a moment after it is saved, and a worker
+whose database is down keeps redirecting with its last good table.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from . import db
+
+
+class RouteTable:
+    def __init__(self, by_slug, shared, default_url, links=frozenset()):
+        # slug -> tuple of (starts_at, ends_at, url), rep routes before shared ones
+        self.by_slug = by_slug
+        # Routes for every rep, used for links with no routes of their own
+        self.shared = shared
+        self.default_url = default_url
+        # Every rep's unique link, routed or not
+        self.links = links
+
+    def resolve(self, slug, now=None):
+        now = now or datetime.utcnow()
+        for starts_at, ends_at, url in self.by_slug.get(slug, self.shared):
+            if (starts_at is None or starts_at <= now) and (ends_at is None or now < ends_at):
+                return url
+        return self.default_url
+
+    def has_link(self, slug):
+        return slug in self.links
+
+    def __len__(self):
+        return len(self.by_slug)
+
+
+def routes_query(now):
+    """Active, unexpired routes with their rep's unique link, newest first."""
+    from .models.link_tracking import LinkRoute
+    from .models.user import User
+
+    return db.select(LinkRoute.user_id, User.unique_link, LinkRoute.starts_at,
+                     LinkRoute.ends_at, LinkRoute.redirect_url)\
+        .outerjoin(User, LinkRoute.user_id == User.id)\
+        .filter(LinkRoute.is_active.is_(True))\
+        .filter(db.or_(LinkRoute.ends_at.is_(None), LinkRoute.ends_at > now))\
+        .order_by(LinkRoute.created_at.desc(), LinkRoute.id.desc())
+
+
+def links_query():
+    """Every rep's unique link."""
+    from .models.user import User
+
+    return db.select(User.unique_link).filter(User.unique_link.isnot(None))
+
+
+def build_table(rows, default_url, links=()):
+    """Build a RouteTable from routes_query and links_query rows."""
+    per_rep, shared = {}, []
+    for user_id, unique_link, starts_at, ends_at, url in rows:
+        entry = (starts_at, ends_at, url)
+        if user_id is None:
+            shared.append(entry)
+        elif unique_link:
+            per_rep.setdefault(unique_link, []).append(entry)
+
+    shared = tuple(shared)
+    by_slug = {slug: tuple(entries) + shared for slug, entries in per_rep.items()}
+    return RouteTable(by_slug, shared, default_url, frozenset(links))
+
+
+def compile_table():
+    """Build a RouteTable from the active LinkRoute rows and the global redirect."""
+    from .models.link_tracking import GlobalRedirect
+
+    rows = db.session.execute(routes_query(datetime.utcnow())).all()
+    links = db.session.execute(links_query()).scalars()
+    return build_table(rows, GlobalRedirect.get_active_url(), links)
+
+
+_table = None
+_built_at = 0.0
+_stamp = None
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def stamp_path(instance_path):
+    return os.path.join(instance_path, 'route_table.stamp')
+
+
+def read_stamp(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _stamp_path():
+    return stamp_path(current_app.instance_path)
+
+
+def _rebuild(app, stamp):
+    """Build a new table in the background and swap it in."""
+    global _table, _built_at, _stamp, _rebuilding
+    try:
+        with app.app_context():
+            try:
+                table = compile_table()
+            except SQLAlchemyError:
+                db.session.rollback()
+                # Database unavailable: keep serving the last good table
+                # and try again after the TTL
+                table = _table
+                app.logger.warning('Route table rebuild failed', exc_info=True)
+        _table, _built_at, _stamp = table, time.monotonic(), stamp
+    finally:
+        _rebuilding = False
+
+
+def get_table():
+    """The current table, rebuilt if an admin changed routes or it expired.
+
+    Only the first lookup in a worker waits for a build; after that a
+    stale table keeps being served while a background thread builds the
+    new one.
+    """
+    global _table, _built_at, _stamp, _rebuilding
+    stamp = read_stamp(_stamp_path())
+    ttl = current_app.config.get('ROUTE_TABLE_TTL', 30)
+    if _table is not None and stamp == _stamp and time.monotonic() - _built_at < ttl:
+        return _table
+
+    if _table is None:
+        with _lock:
+            if _table is None:
+                try:
+                    table = compile_table()
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    raise
+                _table, _built_at, _stamp = table, time.monotonic(), stamp
+        return _table
+
+    with _lock:
+        if _rebuilding:
+            return _table
+        _rebuilding = True
+    threading.Thread(
+        target=_rebuild, args=(current_app._get_current_object(), stamp),
+        name='route-table-rebuild', daemon=True,
+    ).start()
+    return _table
+
+
+def invalidate():
+    """Tell every worker to rebuild its table on its next lookup."""
+    path = _stamp_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        pass
+    os.utime(path, ns=(time.time_ns(), time.time_ns()))
+
+
+def resolve(slug):
+    return get_table().resolve(slug)
+
+
+def has_link(slug):
+    return get_table().has_link(slug)
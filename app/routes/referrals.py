@@ -1,14 +1,19 @@
-from flask import Blueprint, redirect, request, render_template, flash, url_for
+from flask import Blueprint, redirect, request, render_template, flash, url_for, current_app, jsonify, Response, stream_with_context
+import atexit
+import csv
+import io
 import json
 from flask_login import login_required, current_user
-import geoip2.database
 from datetime import datetime, timedelta
 from sqlalchemy import desc
-from ..models.link_tracking import GlobalRedirect, LinkClick
+from sqlalchemy.exc import SQLAlchemyError
+from ..models.link_tracking import GlobalRedirect, LinkClick, LinkRoute, ClickFacet
 from ..models.user import User
 from ..decorators import admin_required
-from .. import db
-from ..forms import RedirectUrlForm
+from .. import db, enrichment, route_table, click_search
+from ..click_spool import get_breaker, get_spool
+from ..rate_limit import get_limiter
+from ..forms import RedirectUrlForm, LinkRouteForm
 
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -16,53 +21,85 @@ class CustomJSONEncoder(json.JSONEncoder):
             return obj.isoformat()
         return super().default(obj)
 
-# Initialize GeoIP reader
-try:
-    geo_reader = geoip2.database.Reader('GeoLite2-City.mmdb')
-except:
-    geo_reader = None
-
 bp = Blueprint('referrals', __name__)
 
+@bp.record_once
+def flush_facets_at_exit(state):
+    """Write this worker's deferred facet counts when it shuts down"""
+    app = state.app
+    def flush():
+        with app.app_context():
+            ClickFacet.flush(force=True)
+    atexit.register(flush)
+
+def get_redirect_url(unique_link):
+    """Destination for a link from the compiled route table"""
+    try:
+        return route_table.resolve(unique_link)
+    except SQLAlchemyError:
+        # Database was unavailable before the first table could be built
+        db.session.rollback()
+        return '/'
+
+def is_rep_link(unique_link):
+    """Whether a link belongs to a rep, per the compiled route table"""
+    try:
+        return route_table.has_link(unique_link)
+    except SQLAlchemyError:
+        db.session.rollback()
+        return False
+
 @bp.route('/r/<unique_link>')
 def handle_referral(unique_link):
     """Handle referral links and track clicks"""
-    # Get the global redirect URL first
-    redirect_url = GlobalRedirect.get_active_url()
-    
-    # If we have a valid user, record the click
-    user = User.query.filter_by(unique_link=unique_link).first()
-    if user:
-        # Get real IP address, checking X-Forwarded-For header first (for proxy scenarios like Ngrok)
-        visitor_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-        if visitor_ip and ',' in visitor_ip:
-            # If multiple IPs in X-Forwarded-For, take the first one (original client)
-            visitor_ip = visitor_ip.split(',')[0].strip()
-            
-        click = LinkClick(
-            user_id=user.id,
-            visitor_ip=visitor_ip,
-            user_agent=request.user_agent.string
-        )
-        
-        # Set device type
-        click.set_device_type()
-        
-        # Add geographic data if GeoIP reader is available
-        if geo_reader and visitor_ip:
-            try:
-                geo_data = geo_reader.city(visitor_ip)
-                click.country = geo_data.country.iso_code
-                click.city = geo_data.city.name
-                click.region = geo_data.subdivisions.most_specific.name
-            except:
-                # If IP lookup fails, continue without geo data
-                pass
-        
-        db.session.add(click)
-        db.session.commit()
+    # Get the destination for this link first
+    redirect_url = get_redirect_url(unique_link)
+    
+    # Get real IP address, checking X-Forwarded-For header first
+    visitor_ip = enrichment.client_ip(request.headers.get('X-Forwarded-For'), request.remote_addr)
+    timestamp = datetime.utcnow()
+    spool_record = {
+        'unique_link': unique_link,
+        'visitor_ip': visitor_ip,
+        'user_agent': request.user_agent.string,
+        'timestamp': timestamp.isoformat()
+    }
+    
+    # Rate limit on the socket address (the proxy's X-Forwarded-For entry,
+    # via ProxyFix), not the client-supplied first one, and only keep
+    # buckets for links that exist
+    link = unique_link if is_rep_link(unique_link) else None
+    if not get_limiter(current_app).allow(request.remote_addr, link):
+        # Over the rate limit: still redirect, but don't record the click
+        return redirect(redirect_url)
     
-    # Always redirect to the global redirect URL
+    breaker = get_breaker()
+    if current_app.config['CLICK_SPOOL_MODE'] == 'always' or breaker.is_open:
+        # The loader resolves the user and enriches the click later; with
+        # the breaker open the database just failed, so don't wait on it
+        get_spool().append(spool_record)
+        return redirect(redirect_url)
+    
+    try:
+        # If we have a valid user, record the click
+        user = User.query.filter_by(unique_link=unique_link).first()
+        if user:
+            # Device type and geographic data are filled in from the request
+            row = LinkClick.enriched_row(user.id, visitor_ip, request.user_agent.string, timestamp)
+            db.session.add(LinkClick(**row))
+            db.session.commit()
+            # Facet counts are written in batches, outside the click's transaction
+            ClickFacet.defer([row])
+    except SQLAlchemyError:
+        # Database is down or locked: keep the click on disk for the loader
+        db.session.rollback()
+        breaker.trip()
+        get_spool().append(spool_record)
+    
+    if not breaker.is_open:
+        ClickFacet.flush()
+    
+    # Always redirect, even if the click couldn't be recorded
     return redirect(redirect_url)
 
 @bp.route('/admin/referrals', methods=['GET', 'POST'])
@@ -80,6 +117,7 @@ def admin_referrals():
         redirect_url = GlobalRedirect(redirect_url=form.url.data)
         db.session.add(redirect_url)
         db.session.commit()
+        route_table.invalidate()
         flash('Redirect URL has been updated.')
         return redirect(url_for('referrals.admin_referrals'))
     
@@ -119,24 +157,57 @@ def admin_referrals():
                          user_stats=user_stats,
                          user_stats_json=encoded_stats)
 
-@bp.route('/admin/click-history')
+@bp.route('/admin/routes', methods=['GET', 'POST'])
 @login_required
 @admin_required
-def click_history():
-    """Show detailed history of all clicks"""
-    page = request.args.get('page', 1, type=int)
-    per_page = 50
+def admin_routes():
+    """Per-rep and campaign-wide link destinations"""
+    form = LinkRouteForm()
+    users = User.query.order_by(User.name).all()
+    form.user_id.choices = [(0, 'All sales reps')] + [(u.id, u.name or u.email) for u in users]
     
-    # Base query
-    query = LinkClick.query.join(User).order_by(desc(LinkClick.timestamp))
+    if form.validate_on_submit():
+        route = LinkRoute(
+            name=form.name.data,
+            user_id=form.user_id.data or None,
+            redirect_url=form.url.data,
+            starts_at=form.starts_at.data,
+            ends_at=form.ends_at.data
+        )
+        db.session.add(route)
+        db.session.commit()
+        route_table.invalidate()
+        flash('Route has been added.')
+        return redirect(url_for('referrals.admin_routes'))
     
-    # Apply filters if present
+    routes = LinkRoute.query.order_by(LinkRoute.is_active.desc(), LinkRoute.created_at.desc()).all()
+    return render_template('referrals/routes.html', form=form, routes=routes, now=datetime.utcnow())
+
+@bp.route('/admin/routes/<int:id>/toggle', methods=['POST'])
+@login_required
+@admin_required
+def toggle_route(id):
+    route = LinkRoute.query.get_or_404(id)
+    route.is_active = not route.is_active
+    db.session.commit()
+    route_table.invalidate()
+    return redirect(url_for('referrals.admin_routes'))
+
+def filter_clicks(query, args):
+    """Apply the click history filters from a query string.
+
+    Returns the filtered query, the filter values and an error message
+    for an invalid IP filter (which is then ignored).
+    """
     filters = {
-        'user_id': request.args.get('user_id', type=int),
-        'device_type': request.args.get('device_type'),
-        'country': request.args.get('country'),
-        'days': request.args.get('days', type=int)
+        'user_id': args.get('user_id', type=int),
+        'device_type': args.get('device_type'),
+        'country': args.get('country'),
+        'days': args.get('days', type=int),
+        'q': args.get('q', '').strip(),
+        'ip': args.get('ip', '').strip()
     }
+    ip_error = None
     
     if filters['user_id']:
         query = query.filter(LinkClick.user_id == filters['user_id'])
@@ -147,20 +218,153 @@ def click_history():
     if filters['days']:
         cutoff_date = datetime.utcnow() - timedelta(days=filters['days'])
         query = query.filter(LinkClick.timestamp >= cutoff_date)
+    if filters['q']:
+        query = click_search.apply_text_search(query, filters['q'])
+    if filters['ip']:
+        if '/' in filters['ip']:
+            # CIDR block, e.g. 203.0.113.0/24 or 2001:db8::/32
+            try:
+                query = click_search.apply_ip_network(query, filters['ip'])
+            except ValueError:
+                ip_error = 'Not a valid CIDR block'
+        else:
+            query = click_search.apply_ip_prefix(query, filters['ip'])
+    
+    return query, filters, ip_error
+
+@bp.route('/admin/click-history')
+@login_required
+@admin_required
+def click_history():
+    """Show detailed history of all clicks"""
+    page = request.args.get('page', 1, type=int)
+    per_page = 50
+    
+    # Base query
+    query = LinkClick.query.join(User).order_by(desc(LinkClick.timestamp))
+    
+    # Apply filters if present
+    query, filters, ip_error = filter_clicks(query, request.args)
     
-    # Execute paginated query
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    clicks = pagination.items
+    if filters['q'] or filters['ip']:
+        # Searches skip the COUNT over every match: fetch one row past the
+        # page to know whether there is a next page
+        pagination = None
+        page = max(page, 1)
+        clicks = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+        has_next = len(clicks) > per_page
+        clicks = clicks[:per_page]
+    else:
+        # Execute paginated query
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        clicks = pagination.items
+        has_next = pagination.has_next
     
-    # Get filter options
-    users = User.query.all()
-    countries = db.session.query(LinkClick.country).distinct().all()
+    # Get filter options from the facet counts instead of scanning link_click
+    facets = ClickFacet.get_all()
+    click_counts = {int(user_id): count for user_id, count in facets['user_id']}
+    users = db.session.query(User.id, User.name, User.email)\
+        .filter(User.id.in_(click_counts))\
+        .all()
+    users = sorted(users, key=lambda u: -click_counts[u.id])
+    device_counts = dict(facets['device_type'])
     device_types = ['desktop', 'mobile', 'tablet']
     
     return render_template('referrals/click_history.html',
                          clicks=clicks,
                          pagination=pagination,
+                         page=page,
+                         per_page=per_page,
+                         has_next=has_next,
                          filters=filters,
+                         ip_error=ip_error,
                          users=users,
-                         countries=[c[0] for c in countries if c[0]],
-                         device_types=device_types)
+                         user_counts=click_counts,
+                         countries=facets['country'],
+                         device_types=device_types,
+                         device_counts=device_counts)
+
+def csv_safe(value):
+    """Cell value that spreadsheets won't evaluate as a formula"""
+    if isinstance(value, str) and value.startswith(('=', '+', '-', '@')):
+        return "'" + value
+    return value
+
+@bp.route('/admin/click-history/export')
+@login_required
+@admin_required
+def export_clicks():
+    """Stream the filtered click history as CSV"""
+    query = db.session.query(LinkClick, User.name, User.email)\
+        .join(User)\
+        .order_by(desc(LinkClick.timestamp))
+    query, filters, ip_error = filter_clicks(query, request.args)
+    if ip_error:
+        return ip_error, 400
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['timestamp', 'name', 'email', 'visitor_ip', 'country', 'region',
+                         'city', 'device_type', 'user_agent'])
+        for click, name, email in query.yield_per(1000):
+            # User agent, city and region come from the visitor
+            writer.writerow([csv_safe(value) for value in (
+                click.timestamp.isoformat() if click.timestamp else '', name, email,
+                click.visitor_ip, click.country, click.region, click.city,
+                click.device_type, click.user_agent)])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    filename = f"clicks-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.csv"
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@bp.route('/admin/metrics')
+@login_required
+@admin_required
+def metrics():
+    """Operational counters as JSON. rate_limit lists the per-key
+    allowed/limited counts of the redirect rate limiter, most limited
+    first (limit= sets how many keys)."""
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({
+        'rate_limit': get_limiter(current_app).stats(limit=limit)
+    })
+
+@bp.route('/admin/click-analytics')
+@login_required
+@admin_required
+def click_analytics():
+    """Ad-hoc click counts from the in-memory columnar snapshot.
+
+    Query string: group_by=country,device_type (any of user_id, country,
+    region, city, device_type), optional filters on the same columns
+    (repeat a parameter to match several values) and days or
+    start/end (ISO dates) to bound the window.
+    """
+    # NumPy is only needed here, keep it out of worker start-up
+    from ..click_analytics import get_columns, GROUP_COLUMNS
+
+    group_by = [c for c in request.args.get('group_by', '').split(',') if c]
+    filters = {c: request.args.getlist(c) for c in GROUP_COLUMNS if c in request.args}
+    try:
+        start = request.args.get('start', type=datetime.fromisoformat)
+        end = request.args.get('end', type=datetime.fromisoformat)
+        days = request.args.get('days', type=int)
+        if days:
+            start = datetime.utcnow() - timedelta(days=days)
+        columns = get_columns()
+        results = columns.query(group_by=group_by, filters=filters, start=start, end=end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'group_by': group_by,
+        'total_clicks_in_snapshot': columns.size,
+        'snapshot_bytes': columns.nbytes,
+        'results': results
+    })
@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import multiprocessing
+import click
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required
 from ..decorators import admin_required
-from ..models.user import User, db
-from ..forms import AdminUserForm, AdminUserEditForm
+from ..models.user import User, UserDeletion, db
+from ..forms import AdminUserForm, AdminUserEditForm, UserImportForm
+from ..user_import import import_users
+from .. import user_deletion
 
 users = Blueprint('users', __name__)
 
@@ -11,7 +15,8 @@ users = Blueprint('users', __name__)
 @admin_required
 def index():
     users_list = User.query.all()
-    return render_template('users/index.html', users=users_list)
+    deletions = UserDeletion.get_open()
+    return render_template('users/index.html', users=users_list, deletions=deletions)
 
 @users.route('/users/create', methods=['GET', 'POST'])
 @login_required
@@ -34,6 +39,36 @@ def create():
             flash('Error creating user. Email might be already taken.', 'error')
     return render_template('users/create.html', form=form)
 
+@users.route('/users/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_csv():
+    form = UserImportForm()
+    result = None
+    if form.validate_on_submit():
+        # Hashing runs inside the request, so keep uploads well under the worker timeout.
+        # Spawn the hashing processes: forking a web worker would copy it
+        # mid-request, along with the state of any deletion threads
+        result = import_users(form.csv_file.data.read(),
+                              max_rows=current_app.config['USER_IMPORT_MAX_UPLOAD_ROWS'],
+                              mp_context=multiprocessing.get_context('spawn'))
+        if result['created']:
+            flash(f"Imported {result['created']} user(s).", 'success')
+        if result['errors']:
+            flash(f"{len(result['errors'])} row(s) were skipped.", 'error')
+    return render_template('users/import.html', form=form, result=result)
+
+@users.cli.command('import')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--batch-size', default=500, show_default=True, help='Rows per insert transaction.')
+@click.option('--workers', type=int, default=None, help='Password hashing processes (default: CPU count).')
+def import_command(csv_file, batch_size, workers):
+    """Bulk-create users from a CSV with name, email and password columns."""
+    result = import_users(csv_file, batch_size=batch_size, workers=workers)
+    for line, message in result['errors']:
+        print(f'Line {line}: {message}')
+    print(f"Created {result['created']} user(s), skipped {len(result['errors'])} row(s)")
+
 @users.route('/users/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -65,12 +100,44 @@ def delete(id):
         flash('Cannot delete admin user!', 'error')
         return redirect(url_for('users.index'))
     
+    open_deletions = UserDeletion.query.filter(UserDeletion.status.in_(UserDeletion.OPEN))
+    if open_deletions.filter(UserDeletion.reassign_to_id == user.id).first():
+        flash('Another user\'s clicks are being moved to this user. Try again once that finishes.', 'error')
+        return redirect(url_for('users.index'))
+    
+    reassign_to = None
+    reassign_id = request.form.get('reassign_to', type=int)
+    if reassign_id:
+        reassign_to = db.session.get(User, reassign_id)
+        if reassign_to is None or reassign_to.id == user.id:
+            flash('Choose another user to move the clicks to.', 'error')
+            return redirect(url_for('users.index'))
+        if open_deletions.filter(UserDeletion.user_id == reassign_to.id).first():
+            flash(f'{reassign_to.email} is being deleted. Choose another user to move the clicks to.', 'error')
+            return redirect(url_for('users.index'))
+    
+    # Clicks are removed in batches in the background, then the user
     try:
-        db.session.delete(user)
-        db.session.commit()
-        flash('User deleted successfully!', 'success')
+        deletion = user_deletion.request_deletion(user, reassign_to)
     except Exception as e:
         db.session.rollback()
         flash('Error deleting user.', 'error')
+        return redirect(url_for('users.index'))
     
+    user_deletion.start(deletion.id)
+    flash(f'Deleting {user.email} in the background.', 'success')
     return redirect(url_for('users.index'))
+
+@users.cli.command('run-deletions')
+@click.option('--batch-size', type=int, default=None, help='Clicks per transaction (default: USER_DELETE_BATCH_SIZE).')
+def run_deletions_command(batch_size):
+    """Run pending user deletions and resume interrupted ones."""
+    ran = user_deletion.run_pending(batch_size)
+    print(f'Ran {ran} user deletion(s)')
+
+@users.cli.command('deletions')
+def deletions_command():
+    """Show the progress of user deletions."""
+    for d in UserDeletion.query.order_by(UserDeletion.id):
+        print(f'{d.id}\t{d.user_email}\t{d.status}\t{d.clicks_done}/{d.clicks_total} clicks'
+              + (f'\t{d.error}' if d.error else ''))
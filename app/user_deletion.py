@@ -0,0 +1,152 @@
+"""Background deletion of users and their click history.
+
+Deleting a rep with millions of clicks in the request would hold one huge
+transaction (or fail on link_click.user_id). Instead the request records
+a UserDeletion and a background thread works through the clicks in
+batches of USER_DELETE_BATCH_SIZE, each its own transaction: it deletes
+the clicks (or moves them to another rep) and adjusts the click facets
+by the same amounts, then records its progress. Once no clicks are left
+it removes the rep's link routes and the user, and tells every worker to
+rebuild its route table and click analytics snapshot. The search index
+follows the deletes through its triggers.
+
+A deletion interrupted by a restart is picked up again by
+`flask users run-deletions`; the batches already committed stay done.
+"""
+import threading
+from datetime import datetime
+from flask import current_app
+from . import db, route_table
+from .models.link_tracking import LinkClick, LinkRoute, ClickFacet
+from .models.user import User, UserDeletion
+
+
+def request_deletion(user, reassign_to=None):
+    """Record that user should be deleted and return the UserDeletion.
+
+    reassign_to is a User to move the clicks to instead of deleting them.
+    """
+    deletion = UserDeletion.query.filter(
+        UserDeletion.user_id == user.id,
+        UserDeletion.status.in_(UserDeletion.OPEN)
+    ).first()
+    if deletion is None:
+        deletion = UserDeletion(user_id=user.id, user_email=user.email, clicks_done=0)
+        db.session.add(deletion)
+    elif deletion.status in UserDeletion.UNFINISHED and not deletion.stale:
+        # Already under way
+        return deletion
+    deletion.reassign_to_id = reassign_to.id if reassign_to else None
+    deletion.status = 'pending'
+    deletion.error = None
+    deletion.clicks_total = deletion.clicks_done + user.link_clicks.count()
+    deletion.updated_at = datetime.utcnow()
+    db.session.commit()
+    return deletion
+
+
+def _claim(deletion_id):
+    """Mark a deletion as running unless another worker is on it."""
+    now = datetime.utcnow()
+    claimed = UserDeletion.query.filter(
+        UserDeletion.id == deletion_id,
+        db.or_(UserDeletion.status == 'pending',
+               db.and_(UserDeletion.status == 'running', UserDeletion.updated_at < now - UserDeletion.STALE_AFTER))
+    ).update({UserDeletion.status: 'running', UserDeletion.updated_at: now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _process_batch(deletion, batch_size):
+    """Delete or move up to batch_size of the user's clicks. Returns how many."""
+    rows = db.session.query(LinkClick.id, LinkClick.user_id, LinkClick.country, LinkClick.device_type)\
+        .filter(LinkClick.user_id == deletion.user_id)\
+        .order_by(LinkClick.id)\
+        .limit(batch_size)\
+        .all()
+    if not rows:
+        return 0
+
+    ids = [row.id for row in rows]
+    if deletion.reassign_to_id:
+        LinkClick.query.filter(LinkClick.id.in_(ids))\
+            .update({LinkClick.user_id: deletion.reassign_to_id}, synchronize_session=False)
+        # Only the user facet changes when clicks move
+        ClickFacet.record([{'user_id': deletion.user_id}] * len(ids), sign=-1)
+        ClickFacet.record([{'user_id': deletion.reassign_to_id}] * len(ids))
+    else:
+        LinkClick.query.filter(LinkClick.id.in_(ids)).delete(synchronize_session=False)
+        ClickFacet.record([row._asdict() for row in rows], sign=-1)
+    return len(ids)
+
+
+def run_deletion(deletion_id, batch_size=None):
+    """Work through a deletion to the end. Returns False if it was already
+    claimed by another worker."""
+    # Imported here so web workers that never delete don't load NumPy
+    from . import click_analytics
+
+    if not _claim(deletion_id):
+        return False
+    batch_size = batch_size or current_app.config['USER_DELETE_BATCH_SIZE']
+    deletion = db.session.get(UserDeletion, deletion_id)
+
+    try:
+        while True:
+            done = _process_batch(deletion, batch_size)
+            deletion.updated_at = datetime.utcnow()
+            if done == batch_size:
+                deletion.clicks_done += done
+                db.session.commit()
+                continue
+
+            # Last batch: clear out the rest (including clicks recorded
+            # meanwhile) and the user in the same transaction
+            while done:
+                deletion.clicks_done += done
+                done = _process_batch(deletion, batch_size)
+            LinkRoute.query.filter_by(user_id=deletion.user_id).delete(synchronize_session=False)
+            ClickFacet.query.filter_by(facet='user_id', value=str(deletion.user_id))\
+                .filter(ClickFacet.count <= 0)\
+                .delete(synchronize_session=False)
+            User.query.filter_by(id=deletion.user_id).delete(synchronize_session=False)
+            deletion.status = 'done'
+            db.session.commit()
+            break
+    except Exception as e:
+        db.session.rollback()
+        deletion.status = 'failed'
+        deletion.error = str(e)[:255]
+        db.session.commit()
+        raise
+
+    ClickFacet._cache = None
+    route_table.invalidate()
+    click_analytics.invalidate()
+    return True
+
+
+def run_pending(batch_size=None):
+    """Run every deletion that is pending or whose worker died. Returns how many ran."""
+    cutoff = datetime.utcnow() - UserDeletion.STALE_AFTER
+    ids = [d.id for d in UserDeletion.query.filter(
+        db.or_(UserDeletion.status == 'pending',
+               db.and_(UserDeletion.status == 'running', UserDeletion.updated_at < cutoff))
+    ).order_by(UserDeletion.id)]
+    return sum(1 for deletion_id in ids if run_deletion(deletion_id, batch_size))
+
+
+def start(deletion_id):
+    """Run a deletion on a background thread of this process."""
+    app = current_app._get_current_object()
+
+    def work():
+        with app.app_context():
+            try:
+                run_deletion(deletion_id)
+            except Exception:
+                app.logger.exception('User deletion %s failed', deletion_id)
+
+    thread = threading.Thread(target=work, name=f'user-deletion-{deletion_id}', daemon=True)
+    thread.start()
+    return thread
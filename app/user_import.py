@@ -0,0 +1,147 @@
+import csv
+import io
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email_validator import validate_email, EmailNotValidError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.security import generate_password_hash
+from . import db
+from .models.user import User
+
+REQUIRED_COLUMNS = ('name', 'email', 'password')
+BATCH_SIZE = 500
+# Below this many rows the pool start-up costs more than hashing inline
+POOL_THRESHOLD = 16
+
+
+def parse_rows(stream):
+    """Read and validate CSV rows.
+
+    Returns a list of valid rows (dicts with line, name, email, password)
+    and a list of (line, message) errors for the rows that were rejected.
+    """
+    try:
+        return _parse_rows(stream)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return [], [(1, f'Could not read the file as UTF-8 CSV: {e}')]
+
+
+def _parse_rows(stream):
+    if isinstance(stream, bytes):
+        stream = io.StringIO(stream.decode('utf-8-sig'))
+    reader = csv.DictReader(stream)
+    header = [h.strip().lower() for h in (reader.fieldnames or [])]
+    missing = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing:
+        return [], [(1, f"Missing column(s): {', '.join(missing)}")]
+    reader.fieldnames = header
+
+    rows, errors, seen = [], [], set()
+    for line, record in enumerate(reader, start=2):
+        name = (record.get('name') or '').strip()
+        email = (record.get('email') or '').strip()
+        password = record.get('password') or ''
+
+        if not name:
+            errors.append((line, 'Name is required'))
+            continue
+        try:
+            email = validate_email(email, check_deliverability=False).normalized
+        except EmailNotValidError as e:
+            errors.append((line, f'Invalid email: {e}'))
+            continue
+        if len(password) < 6:
+            errors.append((line, 'Password must be at least 6 characters long'))
+            continue
+        if email.lower() in seen:
+            errors.append((line, f'Duplicate email in file: {email}'))
+            continue
+
+        seen.add(email.lower())
+        rows.append({'line': line, 'name': name, 'email': email, 'password': password})
+    return rows, errors
+
+
+def hash_passwords(passwords, workers=None, mp_context=None):
+    """Hash passwords in a process pool; scrypt is CPU bound so threads don't help.
+
+    mp_context picks how the pool starts its processes (default: fork on
+    Linux).
+    """
+    if len(passwords) < POOL_THRESHOLD:
+        return [generate_password_hash(p) for p in passwords]
+    chunksize = max(1, len(passwords) // ((workers or 4) * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
+
+
+def _insert_batch(batch):
+    """Insert a batch in one transaction, falling back to row-by-row on failure
+    so a single bad row doesn't reject its neighbours."""
+    try:
+        db.session.execute(insert(User), [r['values'] for r in batch])
+        db.session.commit()
+        return len(batch), []
+    except SQLAlchemyError:
+        db.session.rollback()
+
+    created, errors = 0, []
+    for row in batch:
+        try:
+            db.session.execute(insert(User), [row['values']])
+            db.session.commit()
+            created += 1
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            errors.append((row['line'], f'Database error: {e.__class__.__name__}'))
+    return created, errors
+
+
+def import_users(stream, batch_size=BATCH_SIZE, workers=None, max_rows=None, mp_context=None):
+    """Import sales reps from a CSV with name, email and password columns.
+
+    Returns a dict with the number of users created and a list of
+    (line, message) errors for the rows that were skipped. With max_rows,
+    larger files are rejected before anything is hashed or written.
+    mp_context is passed on to hash_passwords.
+    """
+    rows, errors = parse_rows(stream)
+    if max_rows is not None and len(rows) > max_rows:
+        return {'created': 0, 'errors': [(1, f'The file has {len(rows)} valid rows; uploads are limited '
+                                             f'to {max_rows}. Import larger files with `flask users import`.')]}
+
+    # Reject emails that are already registered before spending time hashing
+    existing = set()
+    emails = [r['email'] for r in rows]
+    for i in range(0, len(emails), batch_size):
+        chunk = emails[i:i + batch_size]
+        existing.update(e.lower() for (e,) in
+                        db.session.query(User.email)
+                        .filter(db.func.lower(User.email).in_([e.lower() for e in chunk])))
+    for row in rows:
+        if row['email'].lower() in existing:
+            errors.append((row['line'], f"Email already registered: {row['email']}"))
+    rows = [r for r in rows if r['email'].lower() not in existing]
+
+    hashes = hash_passwords([r['password'] for r in rows], workers=workers, mp_context=mp_context)
+    now = datetime.utcnow()
+    for row, password_hash in zip(rows, hashes):
+        row['values'] = {
+            'name': row['name'],
+            'email': row['email'],
+            'password_hash': password_hash,
+            'unique_link': str(uuid.uuid4()),
+            'created_at': now,
+            'is_admin': False,
+        }
+
+    created = 0
+    for i in range(0, len(rows), batch_size):
+        batch_created, batch_errors = _insert_batch(rows[i:i + batch_size])
+        created += batch_created
+        errors.extend(batch_errors)
+
+    errors.sort()
+    return {'created': created, 'errors': errors}
@@ -0,0 +1,85 @@
+"""Backfill link_click.visitor_ip_bin and drop the visitor_ip index
+
+Revision ID: 0b5e7c9d3a12
+Revises: f1c8d2a4b390
+Create Date: 2026-10-19 19:20:04.672518
+
+Unique visitor counts and IP searches read visitor_ip_bin, so clicks from
+before it existed are converted here rather than left to
+`flask clicks backfill-ip`. The text column is then only displayed and
+its index goes.
+
+"""
+import ipaddress
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b5e7c9d3a12'
+down_revision = 'f1c8d2a4b390'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 10000
+
+link_click = sa.table(
+    'link_click',
+    sa.column('id', sa.Integer),
+    sa.column('visitor_ip', sa.String),
+    sa.column('visitor_ip_bin', sa.LargeBinary),
+)
+
+
+def pack_ip(value):
+    # Same packing as app.models.link_tracking.pack_ip
+    try:
+        ip = ipaddress.ip_address(value.strip())
+    except (ValueError, AttributeError):
+        return None
+    if ip.version == 4:
+        return b'\x00' * 10 + b'\xff\xff' + ip.packed
+    return ip.packed
+
+
+def upgrade():
+    # Commit every chunk rather than converting the whole table in the
+    # migration's transaction
+    with op.get_context().autocommit_block():
+        _backfill(op.get_bind())
+
+    # Plain DROP INDEX (not batch mode) so SQLite doesn't rebuild
+    # link_click and drop the full-text search triggers
+    op.drop_index('ix_link_click_visitor_ip', table_name='link_click')
+
+
+def _backfill(bind):
+    last_id = 0
+    while True:
+        bind.exec_driver_sql('BEGIN')
+        rows = bind.execute(
+            sa.select(link_click.c.id, link_click.c.visitor_ip)
+            .where(link_click.c.id > last_id)
+            .where(link_click.c.visitor_ip_bin.is_(None))
+            .where(link_click.c.visitor_ip.isnot(None))
+            .order_by(link_click.c.id)
+            .limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            bind.exec_driver_sql('COMMIT')
+            break
+        last_id = rows[-1].id
+        values = [{'row_id': r.id, 'packed': pack_ip(r.visitor_ip)} for r in rows]
+        values = [v for v in values if v['packed'] is not None]
+        if values:
+            bind.execute(
+                link_click.update()
+                .where(link_click.c.id == sa.bindparam('row_id'))
+                .values(visitor_ip_bin=sa.bindparam('packed')),
+                values
+            )
+        bind.exec_driver_sql('COMMIT')
+
+
+def downgrade():
+    op.create_index('ix_link_click_visitor_ip', 'link_click', ['visitor_ip'], unique=False)
@@ -0,0 +1,40 @@
+"""Add link_route table
+
+Revision ID: 4f1c2d9a7b3e
+Revises: 998f882e71ee
+Create Date: 2026-10-19 10:12:41.318904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2d9a7b3e'
+down_revision = '998f882e71ee'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('link_route',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('redirect_url', sa.String(length=500), nullable=False),
+    sa.Column('starts_at', sa.DateTime(), nullable=True),
+    sa.Column('ends_at', sa.DateTime(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('link_route', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_link_route_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('link_route', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_link_route_user_id'))
+
+    op.drop_table('link_route')
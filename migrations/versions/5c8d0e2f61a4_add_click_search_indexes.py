@@ -0,0 +1,66 @@
+"""Add click search indexes
+
+Revision ID: 5c8d0e2f61a4
+Revises: b7e3a1c95d20
+Create Date: 2026-10-19 13:05:22.904617
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8d0e2f61a4'
+down_revision = 'b7e3a1c95d20'
+branch_labels = None
+depends_on = None
+
+SEARCH_TEXT_SQL = "(coalesce(user_agent, '') || ' ' || coalesce(city, '') || ' ' || coalesce(region, ''))"
+
+
+def upgrade():
+    op.create_index('ix_link_click_visitor_ip', 'link_click', ['visitor_ip'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # External-content FTS5 table, kept in sync by triggers
+        op.execute(
+            "CREATE VIRTUAL TABLE link_click_fts USING fts5("
+            "user_agent, city, region, content='link_click', content_rowid='id')"
+        )
+        op.execute(
+            "CREATE TRIGGER link_click_fts_ai AFTER INSERT ON link_click BEGIN "
+            "INSERT INTO link_click_fts(rowid, user_agent, city, region) "
+            "VALUES (new.id, new.user_agent, new.city, new.region); END"
+        )
+        op.execute(
+            "CREATE TRIGGER link_click_fts_ad AFTER DELETE ON link_click BEGIN "
+            "INSERT INTO link_click_fts(link_click_fts, rowid, user_agent, city, region) "
+            "VALUES ('delete', old.id, old.user_agent, old.city, old.region); END"
+        )
+        op.execute(
+            "CREATE TRIGGER link_click_fts_au AFTER UPDATE ON link_click BEGIN "
+            "INSERT INTO link_click_fts(link_click_fts, rowid, user_agent, city, region) "
+            "VALUES ('delete', old.id, old.user_agent, old.city, old.region); "
+            "INSERT INTO link_click_fts(rowid, user_agent, city, region) "
+            "VALUES (new.id, new.user_agent, new.city, new.region); END"
+        )
+        op.execute("INSERT INTO link_click_fts(link_click_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(
+            "CREATE INDEX ix_link_click_search_trgm ON link_click "
+            f"USING gin ({SEARCH_TEXT_SQL} gin_trgm_ops)"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS link_click_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS link_click_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS link_click_fts_ai")
+        op.execute("DROP TABLE IF EXISTS link_click_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_link_click_search_trgm")
+
+    op.drop_index('ix_link_click_visitor_ip', table_name='link_click')
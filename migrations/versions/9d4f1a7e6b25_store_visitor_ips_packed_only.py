@@ -0,0 +1,79 @@
+"""Store visitor IPs packed only
+
+Revision ID: 9d4f1a7e6b25
+Revises: 0b5e7c9d3a12
+Create Date: 2026-10-19 21:12:48.306127
+
+link_click.visitor_ip now only holds values that aren't IP addresses;
+addresses are in visitor_ip_bin and turned back into text for display.
+Clears the text of every packed row, committing every chunk.
+
+"""
+import ipaddress
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f1a7e6b25'
+down_revision = '0b5e7c9d3a12'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 10000
+
+link_click = sa.table(
+    'link_click',
+    sa.column('id', sa.Integer),
+    sa.column('visitor_ip', sa.String),
+    sa.column('visitor_ip_bin', sa.LargeBinary),
+)
+
+
+def unpack_ip(packed):
+    # Same as app.models.link_tracking.unpack_ip
+    if packed[:12] == b'\x00' * 10 + b'\xff\xff':
+        return str(ipaddress.IPv4Address(packed[12:]))
+    return str(ipaddress.IPv6Address(packed))
+
+
+def upgrade():
+    # Outside the migration's transaction: each chunk's UPDATE commits on its own
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        max_id = bind.scalar(sa.select(sa.func.max(link_click.c.id))) or 0
+        for start in range(0, max_id, CHUNK_SIZE):
+            bind.execute(
+                link_click.update()
+                .where(link_click.c.id > start)
+                .where(link_click.c.id <= start + CHUNK_SIZE)
+                .where(link_click.c.visitor_ip_bin.isnot(None))
+                .values(visitor_ip=None)
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        last_id = 0
+        while True:
+            bind.exec_driver_sql('BEGIN')
+            rows = bind.execute(
+                sa.select(link_click.c.id, link_click.c.visitor_ip_bin)
+                .where(link_click.c.id > last_id)
+                .where(link_click.c.visitor_ip.is_(None))
+                .where(link_click.c.visitor_ip_bin.isnot(None))
+                .order_by(link_click.c.id)
+                .limit(CHUNK_SIZE)
+            ).all()
+            if rows:
+                last_id = rows[-1].id
+                bind.execute(
+                    link_click.update()
+                    .where(link_click.c.id == sa.bindparam('row_id'))
+                    .values(visitor_ip=sa.bindparam('text')),
+                    [{'row_id': r.id, 'text': unpack_ip(r.visitor_ip_bin)} for r in rows]
+                )
+            bind.exec_driver_sql('COMMIT')
+            if not rows:
+                break
@@ -0,0 +1,47 @@
+"""Add user_deletion table and link_click.user_id index
+
+Revision ID: a6d3f0b8c217
+Revises: e2a94b7c0f13
+Create Date: 2026-10-19 16:05:12.480391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3f0b8c217'
+down_revision = 'e2a94b7c0f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_deletion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('user_email', sa.String(length=120), nullable=True),
+    sa.Column('reassign_to_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('clicks_total', sa.Integer(), nullable=False),
+    sa.Column('clicks_done', sa.Integer(), nullable=False),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('user_deletion', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_deletion_user_id'), ['user_id'], unique=False)
+
+    # Plain CREATE INDEX (not batch mode) so SQLite doesn't rebuild
+    # link_click and drop the full-text search triggers
+    op.create_index('ix_link_click_user_id', 'link_click', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_link_click_user_id', table_name='link_click')
+
+    with op.batch_alter_table('user_deletion', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_deletion_user_id'))
+
+    op.drop_table('user_deletion')
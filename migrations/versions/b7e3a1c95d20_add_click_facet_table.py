@@ -0,0 +1,37 @@
+"""Add click_facet table
+
+Revision ID: b7e3a1c95d20
+Revises: 4f1c2d9a7b3e
+Create Date: 2026-10-19 11:40:07.552180
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3a1c95d20'
+down_revision = '4f1c2d9a7b3e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('click_facet',
+    sa.Column('facet', sa.String(length=20), nullable=False),
+    sa.Column('value', sa.String(length=100), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('facet', 'value')
+    )
+
+    # Backfill from the existing clicks
+    for facet in ('country', 'device_type', 'user_id'):
+        op.execute(
+            f"INSERT INTO click_facet (facet, value, count) "
+            f"SELECT '{facet}', CAST({facet} AS VARCHAR(100)), COUNT(*) FROM link_click "
+            f"WHERE {facet} IS NOT NULL GROUP BY {facet}"
+        )
+
+
+def downgrade():
+    op.drop_table('click_facet')
@@ -0,0 +1,54 @@
+"""Add binary visitor_ip_bin column to link_click
+
+Revision ID: e2a94b7c0f13
+Revises: 5c8d0e2f61a4
+Create Date: 2026-10-19 14:31:50.218735
+
+Existing rows are converted by `flask clicks backfill-ip` in chunks so
+the migration itself stays short on large tables.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a94b7c0f13'
+down_revision = '5c8d0e2f61a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain ALTER (not batch mode) so SQLite doesn't rebuild link_click and
+    # drop the full-text search triggers
+    op.add_column('link_click', sa.Column('visitor_ip_bin', sa.LargeBinary(length=16), nullable=True))
+    op.create_index('ix_link_click_visitor_ip_bin', 'link_click', ['visitor_ip_bin'], unique=False)
+
+    if op.get_bind().dialect.name == 'sqlite':
+        # Only re-index search text when it changes, not on every IP backfill update
+        op.execute("DROP TRIGGER IF EXISTS link_click_fts_au")
+        op.execute(
+            "CREATE TRIGGER link_click_fts_au AFTER UPDATE OF user_agent, city, region "
+            "ON link_click BEGIN "
+            "INSERT INTO link_click_fts(link_click_fts, rowid, user_agent, city, region) "
+            "VALUES ('delete', old.id, old.user_agent, old.city, old.region); "
+            "INSERT INTO link_click_fts(rowid, user_agent, city, region) "
+            "VALUES (new.id, new.user_agent, new.city, new.region); END"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS link_click_fts_au")
+        op.execute(
+            "CREATE TRIGGER link_click_fts_au AFTER UPDATE ON link_click BEGIN "
+            "INSERT INTO link_click_fts(link_click_fts, rowid, user_agent, city, region) "
+            "VALUES ('delete', old.id, old.user_agent, old.city, old.region); "
+            "INSERT INTO link_click_fts(rowid, user_agent, city, region) "
+            "VALUES (new.id, new.user_agent, new.city, new.region); END"
+        )
+
+    op.drop_index('ix_link_click_visitor_ip_bin', table_name='link_click')
+    # drop_column on SQLite needs SQLite >= 3.35
+    op.drop_column('link_click', 'visitor_ip_bin')
@@ -0,0 +1,26 @@
+"""Add link_click.timestamp index
+
+Revision ID: f1c8d2a4b390
+Revises: a6d3f0b8c217
+Create Date: 2026-10-19 18:42:37.115904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c8d2a4b390'
+down_revision = 'a6d3f0b8c217'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain CREATE INDEX (not batch mode) so SQLite doesn't rebuild
+    # link_click and drop the full-text search triggers
+    op.create_index('ix_link_click_timestamp', 'link_click', ['timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_link_click_timestamp', table_name='link_click')
@@ -0,0 +1,160 @@
+"""Benchmark the sync (Flask) and async (app.async_redirect) redirect paths
+against each other.
+
+Both run under gunicorn, with sync workers and uvicorn workers
+respectively, with the same number of worker processes and the same
+database (DATABASE_URL); each is driven with aiohttp at every concurrency
+level for a fixed time, hitting the links of the bench reps created by
+`flask bench seed`. Reports throughput and latency percentiles as JSON.
+
+    python scripts/bench_redirect.py [--workers 2] [--concurrency 1,16,64,256] \\
+        [--duration 10] [--reps 50] [--output results.json]
+
+The load generator runs on the same machine, so compare the two servers
+with each other rather than with production numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SERVERS = {
+    'sync': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+        '--bind', f'127.0.0.1:{port}', 'app:create_app()'],
+    'async': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--worker-class',
+        'uvicorn.workers.UvicornWorker', '--bind', f'127.0.0.1:{port}', 'app.async_redirect:create_service()'],
+}
+
+USER_AGENT = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 '
+              '(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def load(port, concurrency, duration, reps):
+    import aiohttp
+
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def client(n):
+            nonlocal errors
+            rng = random.Random(n)
+            while time.monotonic() < deadline:
+                url = f'http://127.0.0.1:{port}/r/bench-{rng.randrange(reps)}'
+                headers = {'User-Agent': USER_AGENT,
+                           'X-Forwarded-For': f'203.0.113.{rng.randrange(1, 255)}'}
+                started = time.perf_counter()
+                try:
+                    async with session.get(url, headers=headers, allow_redirects=False) as response:
+                        await response.read()
+                        if response.status != 302:
+                            errors += 1
+                            continue
+                except aiohttp.ClientError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.monotonic()
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+    }
+
+
+def bench_server(name, workers, levels, duration, reps):
+    port = free_port()
+    # Rate limiting would turn recorded clicks into skipped ones part way
+    # through a run, so it is off unless asked for
+    env = dict(os.environ, RATE_LIMIT_ENABLED=os.environ.get('RATE_LIMIT_ENABLED', '0'))
+    process = subprocess.Popen(SERVERS[name](port, workers), cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        # Warm up every worker (route table, enrichment tables, pool)
+        asyncio.run(load(port, workers * 2, 1, reps))
+        results = []
+        for concurrency in levels:
+            result = asyncio.run(load(port, concurrency, duration, reps))
+            print(f'{name:5} c={concurrency:<4} {result["requests_per_s"]:>8} req/s  '
+                  f'p50 {result["p50_ms"]} ms  p99 {result["p99_ms"]} ms  errors {result["errors"]}',
+                  file=sys.stderr)
+            results.append(result)
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', default='1,16,64,256',
+                        help='Comma-separated numbers of concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per level')
+    parser.add_argument('--reps', type=int, default=50, help='Number of bench rep links to hit')
+    parser.add_argument('--servers', default='sync,async')
+    parser.add_argument('--output', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(',')]
+    report = {
+        'workers': args.workers,
+        'duration_s': args.duration,
+        'database': os.environ.get('DATABASE_URL', 'app/app.db'),
+        'results': {name: bench_server(name, args.workers, levels, args.duration, args.reps)
+                    for name in args.servers.split(',')},
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
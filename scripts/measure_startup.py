@@ -0,0 +1,62 @@
+"""Measure worker start-up time.
+
+Each run starts a fresh interpreter, times `create_app()` and the first
+request to a page that renders a template, and reports the median over
+several runs for the default (lazy) start and for WARM_START=1.
+
+    python scripts/measure_startup.py [--runs 5] [--path /login]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+CHILD = '''
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+app = create_app()
+t1 = time.perf_counter()
+response = app.test_client().get(PATH)
+t2 = time.perf_counter()
+print(json.dumps({"create_app_ms": (t1 - t0) * 1000, "first_request_ms": (t2 - t1) * 1000,
+                  "status": response.status_code}))
+'''
+
+
+def run_once(path, warm):
+    env = dict(os.environ, WARM_START='1' if warm else '0')
+    out = subprocess.run([sys.executable, '-c', CHILD.replace('PATH', repr(path))],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/login')
+    args = parser.parse_args()
+
+    # One throwaway run so the Jinja bytecode cache is populated like it is
+    # for every worker after the first
+    run_once(args.path, warm=False)
+
+    report = {}
+    for mode, warm in (('lazy', False), ('warm', True)):
+        runs = [run_once(args.path, warm) for _ in range(args.runs)]
+        create = statistics.median(r['create_app_ms'] for r in runs)
+        first = statistics.median(r['first_request_ms'] for r in runs)
+        report[mode] = {
+            'create_app_ms': round(create, 1),
+            'first_request_ms': round(first, 1),
+            'ready_to_first_response_ms': round(create + first, 1),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()